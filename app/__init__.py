@@ -2,17 +2,21 @@ from flask import Flask
 import json
 from googleapiclient.discovery import build
 from .integrations.google_calendar import get_service
+from .accounts import get_accounts
 
 
 def create_app():
     app = Flask(__name__, template_folder="templates", static_folder="static")
-    app.secret_key = "Your_secret_key_here"
+    # with several accounts, the session cookie says which one is logged in, so it must be signed with a real key
+    app.secret_key = get_accounts().secret_key or "Your_secret_key_here"
 
     with open("api.json", "r") as file:
         api_data = json.load(file)
 
     from .routes import init_routes
+    from .integrations.datalink import start_background_migration
 
     init_routes(app)
+    start_background_migration()
 
     return app
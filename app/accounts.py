@@ -0,0 +1,150 @@
+"""
+Accounts served by one ozycal process.
+
+Without an accounts file, there is a single "default" account: ozycal_settings.json, oauth.json and
+credentials.json in the working directory, as before. With one, every account has its own credentials, its own
+settings snapshot and its own datapath (so datalink logs, option files and the event index are partitioned by
+account), and requests are served for the account logged in with its token (see /login in app/routes.py).
+
+ozycal_accounts.json:
+    {
+        "secret_key": "...",            signs the session cookie that holds the logged in account
+        "max_concurrent_calls": 8,      Google API calls in flight at once, over all accounts
+        "max_calls_per_account": 4,     ... and for any one account
+        "accounts": [
+            {
+                "name": "alice",
+                "token": "...",
+                "settings": "accounts/alice/ozycal_settings.json",
+                "oauth": "accounts/alice/oauth.json",
+                "credentials": "credentials.json",
+                "datapath": "/data/ozycal/alice",   overrides the settings' datapath; must differ between accounts
+                "cache_bytes": 8388608              memory budget of each of the account's response and event caches
+            }
+        ]
+    }
+
+Code outside a request uses the default account (the first one) unless run inside using_account.
+"""
+import hmac
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.scheduling import FairScheduler
+from app.settings import Settings, active_settings, settings
+
+ACCOUNTS_PATH = "ozycal_accounts.json"
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+ACCOUNT_CACHE_BYTES = 8 * 1024 * 1024 # default per account when there are several
+
+
+class Account:
+    def __init__(
+        self,
+        name: str,
+        settings: Settings,
+        oauth_path="oauth.json",
+        credentials_path="credentials.json",
+        token: str | None = None,
+        cache_bytes=DEFAULT_CACHE_BYTES,
+    ):
+        self.name = name
+        self.settings = settings
+        self.oauth_path = oauth_path
+        self.credentials_path = credentials_path
+        self.token = token
+        self.cache_bytes = cache_bytes
+
+
+class Accounts:
+    def __init__(self, accounts: list[Account], require_login=False, secret_key: str | None = None, max_concurrent_calls=8, max_calls_per_account=4):
+        assert accounts, "There must be at least one account"
+        self.accounts = {account.name: account for account in accounts}
+        self.default = accounts[0]
+        self.require_login = require_login
+        self.secret_key = secret_key
+        self.scheduler = FairScheduler(max_concurrent_calls, max_calls_per_account)
+
+    def get(self, name: str | None) -> Account | None:
+        return self.accounts.get(name) if name is not None else None
+
+    def by_token(self, token: str) -> Account | None:
+        for account in self.accounts.values():
+            if account.token is not None and hmac.compare_digest(account.token, token):
+                return account
+        return None
+
+
+def load_accounts(path: str = ACCOUNTS_PATH) -> Accounts:
+    if not os.path.exists(path):
+        return Accounts([Account("default", settings)])
+    with open(path) as f:
+        config = json.load(f)
+
+    accounts = []
+    for entry in config["accounts"]:
+        overrides = {"datapath": entry["datapath"]} if "datapath" in entry else {}
+        accounts.append(Account(
+            entry["name"],
+            Settings(entry.get("settings", "ozycal_settings.json"), overrides),
+            entry.get("oauth", f"{entry['name']}_oauth.json"),
+            entry.get("credentials", "credentials.json"),
+            entry["token"],
+            entry.get("cache_bytes", ACCOUNT_CACHE_BYTES),
+        ))
+
+    names = [account.name for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Account names must be unique: {names}")
+    datapaths = [os.path.abspath(account.settings.settings["datapath"]) for account in accounts]
+    if len(set(datapaths)) != len(datapaths):
+        raise ValueError("Every account needs its own datapath")
+    if "secret_key" not in config:
+        raise ValueError(f"{path} must set a secret_key to sign logins with")
+    return Accounts(
+        accounts,
+        require_login=True,
+        secret_key=config["secret_key"],
+        max_concurrent_calls=config.get("max_concurrent_calls", 8),
+        max_calls_per_account=config.get("max_calls_per_account", 4),
+    )
+
+
+_ACCOUNTS: Accounts | None = None
+_ACCOUNTS_LOCK = threading.Lock()
+
+def get_accounts() -> Accounts:
+    global _ACCOUNTS
+    with _ACCOUNTS_LOCK:
+        if _ACCOUNTS is None:
+            _ACCOUNTS = load_accounts()
+        return _ACCOUNTS
+
+
+_active_account: ContextVar[Account | None] = ContextVar("active_account", default=None)
+
+def current_account() -> Account:
+    return _active_account.get() or get_accounts().default
+
+
+def activate_account(account: Account) -> tuple:
+    """Makes `account` (and its settings) current in this context; returns what deactivate_account needs."""
+    return _active_account.set(account), active_settings.set(account.settings)
+
+
+def deactivate_account(tokens: tuple):
+    account_token, settings_token = tokens
+    active_settings.reset(settings_token)
+    _active_account.reset(account_token)
+
+
+@contextmanager
+def using_account(account: Account):
+    tokens = activate_account(account)
+    try:
+        yield account
+    finally:
+        deactivate_account(tokens)
@@ -0,0 +1,266 @@
+"""
+Bulk backfill of datalink rows for past calendar events.
+
+Events are streamed from Google Calendar over a date range and matched to datalinks: an event is a candidate
+for every datalink whose spec lists its calendar, and its title is matched against title rules and against the
+option texts of the datalink's properties to fill in the row. Candidate rows are validated in batches, and all
+rows of a datalink are written with a single DatalinkLog.add_rows call at the end, so a backfill of tens of
+thousands of events reads and writes each log once (rather than once per push, as push_to_event_datalinks does).
+
+Title rules are a list of {"datalink": ..., "property": ..., "pattern": <regex>, "value": ...}; the first rule
+whose pattern is found in the title (case-insensitively) sets the property. Properties no rule sets take the
+value of the longest option bigText/smallText that appears in the title as whole words, and otherwise the
+property's default (which is empty unless configured). Events where nothing was matched from the title are
+skipped unless `all_events` is set.
+
+Usage:
+    python -m app.backfill --start 2023-01-01 --end 2024-01-01 --rules rules.json --dry-run
+"""
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Iterator
+
+import pytz
+
+from app.accounts import get_accounts, using_account
+from app.events import Event
+from app.export import parse_export_bound
+from app.integrations.datalink import DatalinkLog, add_indexed_rows, initialize_event_datalink_logs, parsed_event_datalink_specs
+from app.integrations.event_cache import get_event_cache
+from app.integrations.event_index import get_event_index
+from app.integrations.google_calendar import get_service, iter_events
+from app.structs import DatalinkField, EventDatalink, EventDatalinkSpec, EventObj
+
+# option texts longer than this many words are not matched against titles
+MAX_OPTION_WORDS = 8
+# rows of each datalink kept in a dry run's summary
+DRY_RUN_SAMPLE_SIZE = 20
+
+
+def title_words(text: str) -> tuple[str, ...]:
+    return tuple(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+class OptionMatcher:
+    """
+    Finds the option of a property whose text appears in a title, as a run of whole words; the longest such text
+    wins, and ties go to the earliest in the title. Texts without any letters (e.g. the "1" of a rating) are not
+    matched, since they would match any number in a title.
+    """
+    def __init__(self, field: DatalinkField):
+        self.values: dict[tuple[str, ...], Any] = {}
+        options = field.options if isinstance(field.options, list) else []
+        for option in options:
+            for text in (option.bigText, option.smallText):
+                words = title_words(text)
+                if words and len(words) <= MAX_OPTION_WORDS and re.search("[a-z]", text.lower()):
+                    self.values.setdefault(words, option.value)
+        self.max_words = max((len(words) for words in self.values), default=0)
+
+    def match(self, words: tuple[str, ...]):
+        for length in range(min(self.max_words, len(words)), 0, -1):
+            for i in range(len(words) - length + 1):
+                value = self.values.get(words[i:i + length])
+                if value is not None:
+                    return value
+        return None
+
+
+class DatalinkMatcher:
+    """Builds the row of one datalink for an event, or None if the event does not match the datalink."""
+    def __init__(self, spec: EventDatalinkSpec, rules: list[dict], all_events: bool = False):
+        self.spec = spec
+        self.calendars = set(spec.calendars)
+        self.all_events = all_events
+        self.rules: dict[str, list[tuple[re.Pattern, Any]]] = defaultdict(list)
+        for rule in rules:
+            if rule["datalink"] == spec.name:
+                if rule["property"] not in spec.properties:
+                    raise ValueError(f"Title rule for unknown property {rule['property']} of datalink {spec.name}")
+                self.rules[rule["property"]].append((re.compile(rule["pattern"], re.IGNORECASE), rule["value"]))
+        self.option_matchers = {prop: OptionMatcher(field) for prop, field in spec.properties.items()}
+        # the values a property without freeform input can take
+        self.allowed_values = {
+            prop: {option.value for option in field.options}
+            for prop, field in spec.properties.items()
+            if not field.freeform and isinstance(field.options, list) and field.options
+        }
+
+    def properties(self, title: str) -> dict[str, Any] | None:
+        words = title_words(title)
+        properties = {}
+        matched = False
+        for prop, field in self.spec.properties.items():
+            value = next((value for pattern, value in self.rules[prop] if pattern.search(title)), None)
+            if value is None:
+                value = self.option_matchers[prop].match(words)
+            if value is None:
+                properties[prop] = field.default
+            else:
+                properties[prop] = value
+                matched = True
+        if not matched and not self.all_events:
+            return None
+        return properties
+
+    def validate(self, properties: dict[str, Any]) -> str | None:
+        """
+        Returns why a row with these properties cannot be written, or None if it can. Properties left empty
+        (nothing matched and no default) are not checked against their options; the row is written with them
+        blank, to be filled in later in the UI.
+        """
+        for prop, allowed in self.allowed_values.items():
+            if properties[prop] != "" and properties[prop] not in allowed:
+                return f"{properties[prop]!r} is not an option of {prop}"
+        return None
+
+
+def event_obj(event: Event, timezone) -> EventObj:
+    # all-day events have naive starts; they are stored as starting at midnight in `timezone`
+    start = event.start if event.start.tzinfo is not None else timezone.localize(event.start)
+    end = event.end if event.end.tzinfo is not None else timezone.localize(event.end)
+    return EventObj(start=start, end=end, title=event.summary, id=event.event_id, calendar=event.calendar)
+
+
+def batched(events: Iterator[Event], batch_size: int) -> Iterator[list[Event]]:
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def backfill_records(
+    service,
+    start: datetime,
+    end: datetime,
+    timezone=pytz.utc,
+    rules: list[dict] = (),
+    datalinks: list[str] | None = None,
+    dry_run: bool = False,
+    overwrite: bool = False,
+    all_events: bool = False,
+    batch_size: int = 500,
+) -> Iterator[dict]:
+    """
+    Backfills the datalinks named in `datalinks` (default: all) for the events starting between start and end,
+    yielding a "progress" record after every batch of `batch_size` events, a "committed" record per datalink
+    written, and finally a "summary" record. Events that already have a row in a datalink keep it unless
+    `overwrite` is set. With `dry_run`, nothing is written and the summary includes a sample of the rows.
+    """
+    initialize_event_datalink_logs()
+    specs = [EventDatalinkSpec(**spec) for spec in parsed_event_datalink_specs()]
+    if datalinks is not None:
+        unknown = set(datalinks) - {spec.name for spec in specs}
+        if unknown:
+            raise ValueError(f"Unknown datalinks: {sorted(unknown)}")
+        specs = [spec for spec in specs if spec.name in datalinks]
+    matchers = [DatalinkMatcher(spec, list(rules), all_events) for spec in specs]
+    datalink_logs = {spec.name: DatalinkLog(spec) for spec in specs}
+    event_index = get_event_index()
+    event_index.sync(list(datalink_logs.values()))
+
+    pending: dict[str, list[EventDatalink]] = defaultdict(list)
+    counts = {spec.name: {"matched": 0, "existing": 0, "invalid": 0} for spec in specs}
+    errors: list[dict] = []
+    events_seen = 0
+    for batch in batched(iter_events(service, start.isoformat(), end.isoformat(), timezone, get_event_cache().series), batch_size):
+        events = [event_obj(event, timezone) for event in batch]
+        # the API returns every event overlapping the range; only those starting in it are backfilled
+        events = [event for event in events if start <= event.start < end]
+        existing = event_index.datalinks_of([event.id for event in events])
+        batch_start = {name: len(rows) for name, rows in pending.items()}
+        for event in events:
+            for matcher in matchers:
+                name = matcher.spec.name
+                if event.calendar not in matcher.calendars:
+                    continue
+                properties = matcher.properties(event.title)
+                if properties is None:
+                    continue
+                if name in existing.get(event.id, ()) and not overwrite:
+                    counts[name]["existing"] += 1
+                    continue
+                error = matcher.validate(properties)
+                if error is not None:
+                    counts[name]["invalid"] += 1
+                    errors.append({"datalink": name, "event_id": event.id, "title": event.title, "error": error})
+                    continue
+                pending[name].append(EventDatalink(datalink_name=name, event=event, properties=properties))
+                counts[name]["matched"] += 1
+        # schema check of the batch's rows, so a bad spec fails the backfill before anything is written
+        for name, rows in pending.items():
+            datalink_logs[name].validate_new(rows[batch_start.get(name, 0):])
+        events_seen += len(batch)
+        yield {"type": "progress", "events": events_seen, "datalinks": counts}
+
+    summary = {"type": "summary", "dry_run": dry_run, "events": events_seen, "datalinks": counts, "errors": errors}
+    if dry_run:
+        summary["sample"] = {name: [row.to_json() for row in rows[:DRY_RUN_SAMPLE_SIZE]] for name, rows in pending.items()}
+    else:
+        for name, rows in pending.items():
+            if rows:
+                add_indexed_rows(datalink_logs[name], rows)
+                yield {"type": "committed", "datalink": name, "rows": len(rows)}
+    yield summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill datalink rows for the calendar events between two dates.")
+    parser.add_argument("--start", required=True, help="ISO date or datetime (inclusive)")
+    parser.add_argument("--end", required=True, help="ISO date or datetime (exclusive)")
+    parser.add_argument("--timezone", default="UTC", help="timezone for dates given without an offset")
+    parser.add_argument("--datalink", action="append", dest="datalinks", help="datalink to backfill (repeatable; default: all)")
+    parser.add_argument("--rules", help="JSON file with a list of title rules")
+    parser.add_argument("--dry-run", action="store_true", help="match and validate, but write nothing")
+    parser.add_argument("--overwrite", action="store_true", help="replace the rows events already have")
+    parser.add_argument("--all-events", action="store_true", help="also add rows for events nothing was matched for")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--account", help="account to run as, with several accounts (default: the first)")
+    args = parser.parse_args(argv)
+    accounts = get_accounts()
+    account = accounts.get(args.account) if args.account else accounts.default
+    if account is None:
+        parser.error(f"Unknown account: {args.account}")
+    with using_account(account):
+        run(args)
+
+
+def run(args):
+    rules = []
+    if args.rules:
+        with open(args.rules) as f:
+            rules = json.load(f)
+    timezone = pytz.timezone(args.timezone)
+    records = backfill_records(
+        get_service(),
+        parse_export_bound(args.start, timezone),
+        parse_export_bound(args.end, timezone),
+        timezone,
+        rules,
+        args.datalinks,
+        args.dry_run,
+        args.overwrite,
+        args.all_events,
+        args.batch_size,
+    )
+    for record in records:
+        if record["type"] == "progress":
+            matched = sum(counts["matched"] for counts in record["datalinks"].values())
+            print(f"{record['events']} events read, {matched} rows matched", file=sys.stderr)
+        elif record["type"] == "committed":
+            print(f"Wrote {record['rows']} rows to {record['datalink']}", file=sys.stderr)
+        else:
+            json.dump(record, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
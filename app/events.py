@@ -40,6 +40,27 @@ class Event:
             is_all_day=is_all_day,
         )
 
+    def to_json(self) -> dict:
+        return {
+            "calendar": self.calendar,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "summary": self.summary,
+            "event_id": self.event_id,
+            "is_all_day": self.is_all_day,
+        }
+
+    @staticmethod
+    def from_json(data: dict) -> "Event":
+        return Event(
+            calendar=data["calendar"],
+            start=datetime.datetime.fromisoformat(data["start"]),
+            end=datetime.datetime.fromisoformat(data["end"]),
+            summary=data["summary"],
+            event_id=data["event_id"],
+            is_all_day=data["is_all_day"],
+        )
+
     def to_fullcalendar(self):
         event_data = {
             "title": self.summary,
@@ -0,0 +1,192 @@
+"""
+Streaming export of calendar events joined with their datalink rows, over arbitrary date ranges.
+
+The range is walked in chunks of `chunk_days`. For each chunk, events are paged lazily from every calendar,
+and the datalink rows starting in the chunk are read from the logs, so memory use depends on the chunk size
+and never on the length of the range.
+
+Usage:
+    python -m app.export --start 2023-01-01 --end 2024-01-01 --format csv > export.csv
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import pytz
+
+from app.accounts import get_accounts, using_account
+from app.events import Event
+from app.integrations.datalink import DatalinkLog, initialize_event_datalink_logs
+from app.integrations.event_cache import get_event_cache
+from app.integrations.google_calendar import get_service, iter_events
+from app.settings import settings
+
+EXPORT_FORMATS = ["ndjson", "csv"]
+CSV_COLUMNS = ["type", "calendar", "event_id", "start", "end", "summary", "is_all_day", "datalink_name", "properties"]
+
+
+def date_chunks(start: datetime, end: datetime, chunk_days: int) -> Iterator[tuple[datetime, datetime]]:
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+
+def event_record(event: Event, datalinks: dict[str, dict]) -> dict:
+    return {
+        "type": "event",
+        "calendar": event.calendar,
+        "event_id": event.event_id,
+        "start": event.start.isoformat(),
+        "end": event.end.isoformat(),
+        "summary": event.summary,
+        "is_all_day": event.is_all_day,
+        "datalinks": datalinks,
+    }
+
+
+def datalink_record(datalink_name: str, row: dict, properties: dict) -> dict:
+    return {
+        "type": "datalink",
+        "calendar": row["calendar"],
+        "event_id": row["event_id"],
+        "start": row["start"],
+        "end": row["stop"],
+        "datalink_name": datalink_name,
+        "properties": properties,
+    }
+
+
+def aware(time: datetime, timezone) -> datetime:
+    # all-day events (and their rows) have naive starts; they are taken as starting at midnight in `timezone`
+    return time if time.tzinfo is not None else timezone.localize(time)
+
+
+def export_records(service, start: datetime, end: datetime, timezone=pytz.utc, chunk_days=7) -> Iterator[dict]:
+    """
+    Yields one "event" record per calendar event between start and end (with the properties of every datalink
+    row for that event under "datalinks"), followed in each chunk by a "datalink" record for every datalink row
+    whose event was not found in that chunk (e.g. because it was deleted or moved in Google Calendar).
+    """
+    initialize_event_datalink_logs()
+    datalink_logs = {spec.name: DatalinkLog(spec) for spec in settings.get_event_datalinks()}
+    # recurring series are fetched once for the whole export (and shared with the app's event cache)
+    series_cache = get_event_cache().series
+
+    def properties(datalink_name: str, row: dict) -> dict:
+        return {prop: row.get(prop, "") for prop in datalink_logs[datalink_name].spec.properties.keys()}
+
+    # events already under way at `start` are exported with the first chunk, so their rows (which start before it) are read with it
+    under_way = {
+        event.event_id: aware(event.start, timezone)
+        for event in iter_events(service, start.isoformat(), (start + timedelta(seconds=1)).isoformat(), timezone, series_cache)
+        if aware(event.start, timezone) < start
+    }
+
+    for i, (chunk_start, chunk_end) in enumerate(date_chunks(start, end, chunk_days)):
+        rows_from = min([chunk_start, *under_way.values()]) if i == 0 else chunk_start
+        # event_id -> datalink name -> row, for rows starting in this chunk (or belonging to an event under way) only
+        rows_by_event: dict[str, dict[str, dict]] = {}
+        for datalink_name, datalink_log in datalink_logs.items():
+            # chunks are half-open, but iter_rows includes its end, so stop just short of it
+            for row in datalink_log.iter_rows(rows_from, chunk_end - timedelta(microseconds=1)):
+                if row["event_id"] not in under_way and aware(datetime.fromisoformat(row["start"]), timezone) < chunk_start:
+                    continue
+                rows_by_event.setdefault(row["event_id"], {})[datalink_name] = row
+
+        for event in iter_events(service, chunk_start.isoformat(), chunk_end.isoformat(), timezone, series_cache):
+            # the API returns every event overlapping the chunk; events that began in an earlier chunk were already exported
+            if aware(event.start, timezone) < chunk_start and i > 0:
+                continue
+            rows = rows_by_event.pop(event.event_id, {})
+            yield event_record(event, {name: properties(name, row) for name, row in rows.items()})
+
+        for rows in rows_by_event.values():
+            for name, row in rows.items():
+                yield datalink_record(name, row, properties(name, row))
+
+
+def to_ndjson(records: Iterator[dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+
+def to_csv(records: Iterator[dict]) -> Iterator[str]:
+    """Yields the CSV one line at a time; nested fields (datalinks / properties) are JSON-encoded."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for record in records:
+        record = dict(record)
+        if "datalinks" in record:
+            record["properties"] = record.pop("datalinks")
+        record["properties"] = json.dumps(record.get("properties", {}))
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def serialize_records(records: Iterator[dict], format: str) -> Iterator[str]:
+    if format == "ndjson":
+        return to_ndjson(records)
+    elif format == "csv":
+        return to_csv(records)
+    raise ValueError(f"Unknown export format: {format}; expected one of {EXPORT_FORMATS}")
+
+
+def parse_export_bound(value: str, timezone) -> datetime:
+    time = datetime.fromisoformat(value)
+    if time.tzinfo is None:
+        time = timezone.localize(time)
+    return time
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export calendar events and datalinks between two dates.")
+    parser.add_argument("--start", required=True, help="ISO date or datetime (inclusive)")
+    parser.add_argument("--end", required=True, help="ISO date or datetime (exclusive)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--timezone", default="UTC", help="timezone for dates given without an offset")
+    parser.add_argument("--chunk-days", type=positive_int, default=7)
+    parser.add_argument("--output", help="file to write to (default: stdout)")
+    parser.add_argument("--account", help="account to run as, with several accounts (default: the first)")
+    args = parser.parse_args(argv)
+    accounts = get_accounts()
+    account = accounts.get(args.account) if args.account else accounts.default
+    if account is None:
+        parser.error(f"Unknown account: {args.account}")
+    with using_account(account):
+        run(args)
+
+
+def run(args):
+    timezone = pytz.timezone(args.timezone)
+    start = parse_export_bound(args.start, timezone)
+    end = parse_export_bound(args.end, timezone)
+    records = export_records(get_service(), start, end, timezone, args.chunk_days)
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for line in serialize_records(records, args.format):
+            out.write(line)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
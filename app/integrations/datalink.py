@@ -1,12 +1,21 @@
 import csv
+import fcntl
 from datetime import datetime
+from functools import lru_cache
+import glob
 import json
 import os
+import re
+import shutil
+import threading
+import time
 from pydantic import BaseModel, Field
-from typing import Union, Dict, List, Any
+from typing import Union, Dict, List, Any, Iterator
 from itertools import groupby
 
 from app.settings import settings
+from app.accounts import get_accounts, using_account
+from app.integrations.event_index import get_event_index
 from app.structs import DatalinkFieldOption, DatalinkField, EventDatalinkSpec, EventObj, EventDatalink, SerializableModel
 
 COLUMN_SPEC = ["id", "start", "stop", "calendar", "event_id"]
@@ -21,10 +30,30 @@ def initialize_event_datalink_logs():
                 writer = csv.writer(f)
                 writer.writerow(header_row)
 
-def parsed_event_datalink_specs() -> List[EventDatalinkSpec]:
+def resolve_options_path(options: str) -> str:
+    """Fills any occurrence of {{datapath}} in an option source path with the datapath."""
+    return options.replace("{{datapath}}", settings.get_datapath())
+
+def load_options_file(path: str) -> list[DatalinkFieldOption]:
+    """
+    Loads a list of options from a .json or .csv file.
+    For .json the file is loaded as is; for .csv the first column is the value AND bigText, the second the smallText.
+    Any other path is returned unchanged as the options (matching what the client expects for string options).
+    """
+    if path.endswith(".json"):
+        with open(path) as f:
+            return [DatalinkFieldOption(**option) for option in json.load(f)]
+    elif path.endswith(".csv"):
+        with open(path) as f:
+            return [DatalinkFieldOption(bigText=row[0], smallText=row[1], value=row[0]) for row in csv.reader(f)]
+    return path
+
+def parsed_event_datalink_specs(expand_indexed: bool = True) -> List[EventDatalinkSpec]:
     """
     Parses the event datalinks schemas from the settings, replacing any {{datapath}} with the datapath,
     and converting any string properties to lists of DatalinkFieldOption objects.
+    If `expand_indexed` is False, file-backed properties are not expanded; instead they are marked as
+    `indexed`, and the client is expected to query them through /api/datalink_options.
     """
     datalinks = settings.get_event_datalinks()
     for datalink in datalinks:
@@ -32,18 +61,87 @@ def parsed_event_datalink_specs() -> List[EventDatalinkSpec]:
             # effectively, this looks through string properties and replaces {{datapath}} with the datapath
             # (non-string properties are a DatalinkField.options list instead)
             if isinstance(property_config.options, str):
-                # interpret string as path, filling any occurrence of {{datapath}} with the datapath
-                datalink.properties[property_name].options = datalink.properties[property_name].options.replace("{{datapath}}", settings.get_datapath())
-                # check if it's json or csv, if json just load, if csv interpret first column as value AND bigText, second as smallText
-                if datalink.properties[property_name].options.endswith(".json"):
-                    with open(datalink.properties[property_name].options) as f:
-                        datalink.properties[property_name].options = json.load(f)
-                elif datalink.properties[property_name].options.endswith(".csv"):
-                    with open(datalink.properties[property_name].options) as f:
-                        datalink.properties[property_name].options = [DatalinkFieldOption(bigText=row[0], smallText=row[1], value=row[0]) for row in csv.reader(f)]
+                path = resolve_options_path(property_config.options)
+                if not expand_indexed and path.endswith((".json", ".csv")):
+                    property_config.options = []
+                    property_config.indexed = True
+                else:
+                    property_config.options = load_options_file(path)
     datalinks = [spec.model_dump() for spec in datalinks]
     return datalinks
 
+class LogLock:
+    """
+    Serializes writes to one datalink log, between threads and between worker processes: a thread lock, plus
+    an flock on {name}.lock next to the log while any thread of this process holds it. Reentrant, so e.g.
+    add_rows can call ensure_schema while holding it.
+    """
+    def __init__(self, path: str):
+        self.lock_path = f"{path[: -len('.csv')]}.lock"
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.file = open(self.lock_path, "a")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except BaseException:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+# one lock per log path, shared by every DatalinkLog for that path, so pushes and background migrations do not interleave
+_LOG_LOCKS: dict[str, LogLock] = {}
+_LOG_LOCKS_LOCK = threading.Lock()
+
+def log_lock(path: str) -> LogLock:
+    with _LOG_LOCKS_LOCK:
+        if path not in _LOG_LOCKS:
+            _LOG_LOCKS[path] = LogLock(path)
+        return _LOG_LOCKS[path]
+
+@lru_cache(maxsize=256)
+def column_mapping(header: tuple[str, ...], columns: tuple[str, ...]) -> tuple[int | None, ...]:
+    """
+    For each of `columns`, the index of that column in a file with the given header, or None if the file
+    predates the column. Resolved once per distinct header, i.e. once per file version.
+    """
+    return tuple(header.index(column) if column in header else None for column in columns)
+
+def read_header(path: str) -> list[str]:
+    with open(path, "r") as f:
+        return next(csv.reader(f), [])
+
+def replace_csv(path: str, header: list[str], rows) -> None:
+    """
+    Writes a .csv file to a temporary path and moves it over `path`, so readers that already opened the old
+    file keep reading all of it.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(temp_path, path)
+
+def segment_version(path: str) -> int:
+    return int(path.rsplit(".v", 1)[1][: -len(".csv")])
+
 class DatalinkLog:
     """
     These are all interfaces to .csv files, with some helper functions.
@@ -51,30 +149,108 @@ class DatalinkLog:
     The row schema in the .csv is:
     id start end calendar event_id {... properties ...}
     where {... properties ...} are the keys in self.spec.properties ( = EventDatalinkSpec.properties)
+
+    When properties are added to the spec, the current file is not rewritten; it is renamed to a versioned
+    segment ({name}.v{n}.csv) and a new file with the new header is started. Reads map every segment onto the
+    spec by column name (backfilling missing properties with their defaults), and migrate_segment folds old
+    segments into the current file one at a time in the background.
+
+    Writers hold the log's lock, and never change a file in place: they rename it, or write a new one and move
+    it over the old path (replace_csv). Readers list and open the files under the lock, so a read sees the log
+    as it was when it started, however long it takes and whatever is written meanwhile.
     """
     def __init__(self, datalink_spec: EventDatalinkSpec):
         self.spec = datalink_spec
         self.path = settings.get_datalink_datapath(datalink_spec.name)
     
+    @property
+    def lock(self) -> LogLock:
+        return log_lock(self.path)
+    
+    def columns(self) -> list[str]:
+        return COLUMN_SPEC + list(self.spec.properties.keys())
+    
+    def defaults(self) -> list[str]:
+        return [""] * len(COLUMN_SPEC) + [str(field.default) for field in self.spec.properties.values()]
+    
+    def segment_paths(self) -> list[str]:
+        """Paths of the old segments of this log, oldest first (not including the current file, self.path)."""
+        base = self.path[: -len(".csv")]
+        paths = [path for path in glob.glob(glob.escape(base) + ".v*.csv") if re.fullmatch(r"\d+", path[len(base) + 2 : -len(".csv")])]
+        return sorted(paths, key=segment_version)
+    
+    def ensure_schema(self) -> str | None:
+        """
+        Starts a new segment if the spec has properties the current file has no column for. Columns the spec no
+        longer has are carried over (after the spec's columns) so that their data survives migration.
+        Returns the path the current file was renamed to, or None if the schema already fit.
+        """
+        with self.lock:
+            header = read_header(self.path)
+            if all(column in header for column in self.columns()):
+                return None
+            segments = self.segment_paths()
+            version = segment_version(segments[-1]) + 1 if segments else 1
+            segment = f"{self.path[: -len('.csv')]}.v{version}.csv"
+            os.rename(self.path, segment)
+            with open(self.path, "w") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.columns() + [column for column in header if column not in self.columns()])
+            return segment
+    
+    def _mapped_rows(self, path: str, columns: list[str]) -> Iterator[list[str]]:
+        """Yields the rows of one segment with values rearranged into `columns`, backfilled with defaults."""
+        with open(path, "r") as f:
+            yield from self._mapped_file_rows(f, columns)
+
+    def _mapped_file_rows(self, f, columns: list[str]) -> Iterator[list[str]]:
+        """Like _mapped_rows, for a segment that is already open."""
+        defaults = dict(zip(self.columns(), self.defaults()))
+        reader = csv.reader(f)
+        header = tuple(next(reader))
+        mapping = column_mapping(header, tuple(columns))
+        for row in reader:
+            if not row:
+                continue
+            yield [
+                row[i] if i is not None and i < len(row) else defaults.get(column, "")
+                for column, i in zip(columns, mapping)
+            ]
+    
     def default_title(self, row: dict):
         if self.spec.eventTitleSourceProperty is not None:
             return row[self.spec.eventTitleSourceProperty]
         return "UNKNOWN"
     
     def get_rows(self, start: datetime | None = None, end: datetime | None = None) -> list[dict]:
-        if start is None:
-            start = datetime.fromtimestamp(0)
-        if end is None:
-            # get last date
-            end = datetime.max
-        with open(self.path, "r") as f:
-            reader = csv.reader(f)
-            headers = next(reader)  # Get the headers from the first row
-            return [
-                {headers[i]: value for i, value in enumerate(row)}
-                for row in reader
-                if start <= datetime.fromisoformat(row[COLUMN_SPEC.index("start")]) <= end
-            ]
+        return list(self.iter_rows(start, end))
+    
+    def iter_file_rows(self, start: datetime | None = None, end: datetime | None = None) -> Iterator[tuple[str, dict]]:
+        """Like iter_rows, but yields (name of the file the row is in, row)."""
+        columns = self.columns()
+        start_index = columns.index("start")
+        # the files are opened together under the lock, so a segment started or migrated meanwhile does not hide rows
+        files = []
+        try:
+            with self.lock:
+                for path in self.segment_paths() + [self.path]:
+                    files.append((path, open(path, "r")))
+            for path, f in files:
+                for row in self._mapped_file_rows(f, columns):
+                    # only compare against the bounds that were given, so unbounded reads work for both naive and aware times
+                    if start is not None or end is not None:
+                        row_start = datetime.fromisoformat(row[start_index])
+                        if (start is not None and row_start < start) or (end is not None and row_start > end):
+                            continue
+                    yield os.path.basename(path), dict(zip(columns, row))
+        finally:
+            for _, f in files:
+                f.close()
+
+    def iter_rows(self, start: datetime | None = None, end: datetime | None = None) -> Iterator[dict]:
+        """Like get_rows, but yields rows one at a time while reading, so memory use does not grow with the log."""
+        for _, row in self.iter_file_rows(start, end):
+            yield row
     
     def validate_new(self, rows: list[EventDatalink]):
         for row in rows:
@@ -83,64 +259,216 @@ class DatalinkLog:
             assert all(prop in self.spec.properties for prop in row.properties.keys()), f"Invalid event datalink properties: {row.properties.keys()}; does not match {self.spec.properties.keys()}"
             assert isinstance(row.event, EventObj), "Event datalink event must be an instance of EventObj"
     
-    def add_rows(self, rows: list[EventDatalink]):
+    def add_rows(self, rows: list[EventDatalink]) -> list[dict]:
         """
         Adds rows to the datalink log, validating that they fit the schema.
         If there are rows that have an event ID that has already appeared beforehand, then instead of writing that as a new row, that row should be updated.
+        Returns the rows as written (column name -> value).
         """
         self.validate_new(rows)
         
-        # Read all existing rows
-        all_rows = []
-        with open(self.path, "r") as f:
-            reader = csv.reader(f)
-            headers = next(reader)  # Skip header
-            all_rows = list(reader)
-        
-        # Create a dictionary of existing rows for easy lookup
-        existing_rows = {row[COLUMN_SPEC.index("event_id")]: row for row in all_rows}
-        
-        # Update existing rows and add new ones
-        for row in rows:
-            row_data = [
-                str(self.get_next_id()) if row.event.id not in existing_rows else existing_rows[row.event.id][0],
-                row.event.start.isoformat(),
-                row.event.end.isoformat(),
-                row.event.calendar,
-                row.event.id,
-            ]
+        with self.lock:
+            self.ensure_schema()
+            event_id_index = COLUMN_SPEC.index("event_id")
             
-            # Add properties in the order specified by self.spec.properties
-            for prop in self.spec.properties.keys():
-                row_data.append(row.properties.get(prop, ""))
+            # Read all existing rows
+            all_rows = []
+            with open(self.path, "r") as f:
+                reader = csv.reader(f)
+                headers = next(reader)  # Skip header
+                all_rows = [row for row in reader if row]
             
-            if row.event.id in existing_rows:
-                existing_rows[row.event.id] = row_data
-            else:
-                all_rows.append(row_data)
-        
-        # Write updated file
-        with open(self.path, "w") as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)  # Write header
-            writer.writerows(all_rows)
+            # Create a dictionary of existing rows for easy lookup (row position in the current file, or old segment path)
+            existing_rows = {row[event_id_index]: i for i, row in enumerate(all_rows)}
+            new_ids = {row.event.id for row in rows}
+            # rows of these events in old segments, mapped onto the current file's header
+            ids_in_segments = {}
+            for path in self.segment_paths():
+                for row in self._mapped_rows(path, headers):
+                    if row[event_id_index] in new_ids:
+                        ids_in_segments[row[event_id_index]] = row
+            next_id = self.get_next_id()
+            
+            # Update existing rows and add new ones
+            written = []
+            for row in rows:
+                if row.event.id in existing_rows:
+                    previous = all_rows[existing_rows[row.event.id]]
+                elif row.event.id in ids_in_segments:
+                    previous = ids_in_segments[row.event.id]
+                else:
+                    previous = None
+                if previous is not None:
+                    row_id = previous[0]
+                else:
+                    row_id = str(next_id)
+                    next_id += 1
+                row_data = [
+                    row_id,
+                    row.event.start.isoformat(),
+                    row.event.end.isoformat(),
+                    row.event.calendar,
+                    row.event.id,
+                ]
+                
+                # Add properties in the order of the file's header; columns the spec no longer has keep the
+                # row's previous values (new rows leave them empty)
+                for i, column in enumerate(headers[len(COLUMN_SPEC):], start=len(COLUMN_SPEC)):
+                    if column in self.spec.properties:
+                        row_data.append(row.properties.get(column, ""))
+                    else:
+                        row_data.append(previous[i] if previous is not None and i < len(previous) else "")
+                
+                if row.event.id in existing_rows:
+                    all_rows[existing_rows[row.event.id]] = row_data
+                else:
+                    existing_rows[row.event.id] = len(all_rows)
+                    all_rows.append(row_data)
+                written.append(dict(zip(headers, row_data)))
+            
+            # Write updated file
+            replace_csv(self.path, headers, all_rows)
+            
+            # the updated rows now live in the current file, so their old versions are dropped from the segments
+            if ids_in_segments:
+                for path in self.segment_paths():
+                    self._rewrite_segment_without(path, set(ids_in_segments))
+            return written
+
+    def apply_event_changes(self, changes: dict[str, dict | None], files: dict[str, str] | None = None) -> dict[str, str]:
+        """
+        Applies changes to the events behind rows, keyed by event id: None deletes the event's row, otherwise
+        the row's "start", "stop" and/or "event_id" are set to the given values. `files` maps event ids to the
+        name of the file their row is in (as recorded by the event index), so only those files are read and
+        rewritten; rows not found there (e.g. because the file was since renamed to a segment by ensure_schema)
+        are looked for in the rest of the log. Returns the name of the file each changed event's row was in.
+        """
+        found: dict[str, str] = {}
+        with self.lock:
+            paths = self.segment_paths() + [self.path]
+            paths_by_name = {os.path.basename(path): path for path in paths}
+            hinted: dict[str, dict[str, dict | None]] = {}
+            for event_id, file in (files or {}).items():
+                if event_id in changes and file in paths_by_name:
+                    hinted.setdefault(paths_by_name[file], {})[event_id] = changes[event_id]
+            for path, file_changes in hinted.items():
+                found.update(self._apply_changes_to_file(path, file_changes))
+            remaining = {event_id: change for event_id, change in changes.items() if event_id not in found}
+            for path in paths:
+                if not remaining:
+                    break
+                in_file = self._apply_changes_to_file(path, remaining)
+                found.update(in_file)
+                remaining = {event_id: change for event_id, change in remaining.items() if event_id not in in_file}
+        return found
+
+    def _apply_changes_to_file(self, path: str, changes: dict[str, dict | None]) -> dict[str, str]:
+        """Applies the changes to the rows of one file, rewriting it if any row changed; returns event id -> file name."""
+        with open(path, "r") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = [row for row in reader if row]
+        event_id_index = header.index("event_id")
+        kept = []
+        found = {}
+        for row in rows:
+            if row[event_id_index] not in changes:
+                kept.append(row)
+                continue
+            found[row[event_id_index]] = os.path.basename(path)
+            change = changes[row[event_id_index]]
+            if change is None:
+                continue
+            for column, value in change.items():
+                row[header.index(column)] = value
+            kept.append(row)
+        if found:
+            replace_csv(path, header, kept)
+        return found
+
+    def _rewrite_segment_without(self, path: str, event_ids: set[str]):
+        with open(path, "r") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = [row for row in reader if row]
+        kept = [row for row in rows if row[COLUMN_SPEC.index("event_id")] not in event_ids]
+        if len(kept) == len(rows):
+            return
+        replace_csv(path, header, kept)
+
+    def migrate_segment(self) -> str | None:
+        """
+        Moves the rows of the oldest segment into the current file (appending, mapped onto its header), then
+        deletes the segment. Returns the path of the segment, or None if there was nothing to migrate.
+        """
+        with self.lock:
+            segments = self.segment_paths()
+            if not segments:
+                return None
+            header = read_header(self.path)
+            # appended to a copy, since readers may have the current file open
+            temp_path = f"{self.path}.tmp"
+            shutil.copyfile(self.path, temp_path)
+            with open(temp_path, "a") as f:
+                writer = csv.writer(f)
+                writer.writerows(self._mapped_rows(segments[0], header))
+            os.replace(temp_path, self.path)
+            os.remove(segments[0])
+            return segments[0]
 
     def get_next_id(self):
         # Implement a method to get the next available ID, based on 1 + the current greatest id (or 0 if no non-header rows yet added)
-        try:
-            with open(self.path, "r") as f:
-                reader = csv.reader(f)
-                next(reader)  # Try to skip the header row
-                ids = [int(row[0]) for row in reader if row]  # Assuming ID is the first column
-            
-            if not ids:
-                return 1  # If no rows exist yet, start with ID 1
-            else:
-                return max(ids) + 1  # Return the next available ID
-        except StopIteration:
-            # File is empty or contains only a header
-            return 1
+        ids = []
+        for path in self.segment_paths() + [self.path]:
+            try:
+                with open(path, "r") as f:
+                    reader = csv.reader(f)
+                    next(reader)  # Try to skip the header row
+                    ids.extend(int(row[0]) for row in reader if row)  # Assuming ID is the first column
+            except StopIteration:
+                # File is empty or contains only a header
+                continue
         
+        if not ids:
+            return 1  # If no rows exist yet, start with ID 1
+        else:
+            return max(ids) + 1  # Return the next available ID
+        
+
+def migrate_datalink_logs() -> int:
+    """Migrates at most one old segment of every datalink log; returns how many segments were migrated."""
+    migrated = 0
+    for spec in settings.get_event_datalinks():
+        datalink_log = DatalinkLog(spec)
+        if not os.path.exists(datalink_log.path):
+            continue
+        event_index = get_event_index()
+        with datalink_log.lock:
+            event_index.sync([datalink_log])
+            segment = datalink_log.migrate_segment()
+            if segment is not None:
+                # migration moves rows between files without changing them, so only their files change in the index
+                event_index.move_file(datalink_log, os.path.basename(segment), os.path.basename(datalink_log.path))
+                migrated += 1
+    return migrated
+
+def start_background_migration(interval=60):
+    """
+    Starts a daemon thread that migrates old datalink log segments, one per log every `interval` seconds,
+    for every account.
+    """
+    def run():
+        while True:
+            for account in get_accounts().accounts.values():
+                try:
+                    with using_account(account):
+                        migrate_datalink_logs()
+                except Exception as e:
+                    print(f"Error migrating datalink logs of account {account.name}: {str(e)}")
+            time.sleep(interval)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
 
 def pull_from_event_datalinks(start: datetime, end: datetime) -> dict[str, list[EventDatalink]]:
     """
@@ -176,6 +504,22 @@ def pull_from_event_datalinks(start: datetime, end: datetime) -> dict[str, list[
     
     return result
 
+def add_indexed_rows(datalink_log: DatalinkLog, rows: list[EventDatalink]) -> list[dict]:
+    """
+    Adds rows to a log (see DatalinkLog.add_rows) and records them in the event index. The index is updated
+    before the log's lock is released, so no other write can land in between.
+    """
+    event_index = get_event_index()
+    with datalink_log.lock:
+        event_index.sync([datalink_log])
+        segment = datalink_log.ensure_schema()
+        if segment is not None:
+            # the rows of the current file now live in the new segment
+            event_index.move_file(datalink_log, os.path.basename(datalink_log.path), os.path.basename(segment))
+        written = datalink_log.add_rows(rows)
+        event_index.record_rows(datalink_log, written)
+    return written
+
 def push_to_event_datalink(rows: list[EventDatalink]) -> bool:
     """
     Takes a set of datalink rows, assumed to all fit the schema for some EventDatalink,
@@ -192,8 +536,7 @@ def push_to_event_datalink(rows: list[EventDatalink]) -> bool:
         edl = next((EventDatalinkSpec(**edl) for edl in edls if edl['name'] == datalink_name), None)
         assert edl is not None, f"Invalid event datalink name: {datalink_name}"
         
-        datalink_log = DatalinkLog(edl)
-        datalink_log.add_rows(rows)
+        add_indexed_rows(DatalinkLog(edl), rows)
         
         return True
     except Exception as e:
@@ -222,4 +565,51 @@ def push_to_event_datalinks(rows: list[EventDatalink]) -> list[str]:
             failed_datalinks.append(datalink_name)
             print(f"Failed to push to datalink: {datalink_name}")
 
-    return failed_datalinks  # Return list of datalink names where push failed
\ No newline at end of file
+    return failed_datalinks  # Return list of datalink names where push failed
+
+def cascade_event_changes(moved: dict[str, tuple[datetime, datetime]], deleted: list[str], remapped: dict[str, str]) -> dict[str, int]:
+    """
+    Carries event changes made in Google Calendar over to the datalink rows of those events: `moved` maps event
+    ids to their new (start, end), rows of `deleted` events are removed, and `remapped` maps old event ids to new
+    ones (e.g. the temporary ids of events created in the client). Affected rows are found through the event
+    index, so logs without any affected row are not read at all, and of the others only the files with an
+    affected row are read and rewritten. Returns the number of rows changed per datalink.
+    """
+    initialize_event_datalink_logs()
+    datalink_logs = {spec.name: DatalinkLog(spec) for spec in settings.get_event_datalinks()}
+    event_index = get_event_index()
+    event_ids = list(moved) + list(remapped) + list(deleted)
+
+    changed = {}
+    for datalink_name, datalink_log in datalink_logs.items():
+        # the affected rows are looked up, changed and re-indexed under the log's lock, so no other write can land in between
+        with datalink_log.lock:
+            event_index.sync([datalink_log])
+            affected = {event_id for event_id, datalinks in event_index.datalinks_of(event_ids).items() if datalink_name in datalinks}
+            if not affected:
+                continue
+            changes: dict[str, dict | None] = {}
+            for event_id, (start, end) in moved.items():
+                if event_id in affected:
+                    changes.setdefault(event_id, {}).update({"start": start.isoformat(), "stop": end.isoformat()})
+            for old_id, new_id in remapped.items():
+                if old_id in affected:
+                    changes.setdefault(old_id, {})["event_id"] = new_id
+            for event_id in deleted:
+                if event_id in affected:
+                    changes[event_id] = None
+            # only the files the index has the rows in are rewritten
+            files = datalink_log.apply_event_changes(changes, event_index.files_of(datalink_log, list(changes)))
+            changed[datalink_name] = len(files)
+            event_index.apply_changes(datalink_log, changes, files)
+    return changed
+
+def find_orphaned_datalink_rows(start: datetime, end: datetime, event_ids: set[str]) -> list[dict]:
+    """
+    Returns the index entries of datalink rows starting between start and end whose event is not among
+    `event_ids` (the events that exist in that range), without reading the logs themselves.
+    """
+    initialize_event_datalink_logs()
+    event_index = get_event_index()
+    event_index.sync([DatalinkLog(spec) for spec in settings.get_event_datalinks()])
+    return [entry for entry in event_index.entries_between(start, end) if entry["event_id"] not in event_ids]
@@ -0,0 +1,205 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from app.accounts import current_account
+from app.settings import settings
+from app.structs import DatalinkFieldOption
+from app.integrations.datalink import DatalinkLog, load_options_file, resolve_options_path
+from app.shared_cache import get_shared_cache
+
+RECENCY_HALF_LIFE_DAYS = 30 # a use of an option counts half as much after this many days
+SHARED_OPTIONS_TTL = 24 * 60 * 60 # entries are keyed by file mtimes, so this only bounds how long stale ones linger
+MAX_PREFIX_LENGTH = 24 # trie keys are truncated to this; longer queries are finished off with a substring check
+
+MAX_OPTION_INDEXES = 16 # per account; the least recently used are dropped beyond this
+MAX_SEARCH_LIMIT = 100 # most options one search may return
+
+# account name -> (datalink log path, property name) -> (signature, OptionIndex); rebuilt when the signature changes
+_OPTION_INDEXES: dict[str, OrderedDict[tuple[str, str], tuple[tuple, "OptionIndex"]]] = {}
+_OPTION_INDEXES_LOCK = threading.Lock()
+
+
+def option_label(option: DatalinkFieldOption) -> str:
+    # this is the same string the client shows and filters on
+    return f"{option.bigText} - {option.smallText}".lower()
+
+
+def subsequence_gaps(query: str, text: str) -> int | None:
+    """
+    Returns the number of skipped characters between the first and last matched character if every
+    character of `query` appears in `text` in order, otherwise None. Fewer gaps means a tighter match.
+    """
+    position = -1
+    first = None
+    for char in query:
+        position = text.find(char, position + 1)
+        if position == -1:
+            return None
+        if first is None:
+            first = position
+    if first is None:
+        return 0
+    return position - first + 1 - len(query)
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: dict[str, "_TrieNode"] = {}
+        self.ids: list[int] = []
+
+
+class OptionIndex:
+    """
+    A search index over the options of one datalink property.
+
+    Every option is inserted into a prefix trie under its full label and under each word of its label,
+    so "meet" finds both "meeting - weekly" and "team meeting - ". Each trie node keeps the ids of all
+    options below it, pre-sorted by usage score, so a prefix query is a walk down the trie plus a slice.
+    If prefixes do not fill `limit`, the remaining slots are filled by subsequence (fuzzy) matches.
+    """
+    def __init__(self, options: list[DatalinkFieldOption], usage: dict[str, float] | None = None):
+        self.options = options
+        self.labels = [option_label(option) for option in options]
+        usage = usage or {}
+        # title source properties are logged as "bigText - smallText" (see addEventFlow), others by value
+        self.scores = [
+            usage.get(str(option.value), 0.0) + usage.get(f"{option.bigText} - {option.smallText}", 0.0)
+            for option in options
+        ]
+        # option ids ordered by usage score (ties keep file order)
+        self.ranked = sorted(range(len(options)), key=lambda i: -self.scores[i])
+        self.root = _TrieNode()
+        for i in self.ranked:
+            label = self.labels[i]
+            keys = {label} | {label[m.start():] for m in re.finditer(r"\b\w", label)}
+            for key in keys:
+                self._insert(key, i)
+
+    def _insert(self, key: str, option_id: int):
+        node = self.root
+        for char in key[:MAX_PREFIX_LENGTH]:
+            node = node.children.setdefault(char, _TrieNode())
+            # ids are inserted in ranked order, so every node's list stays sorted by score
+            if not node.ids or node.ids[-1] != option_id:
+                node.ids.append(option_id)
+
+    def _prefix_ids(self, query: str) -> list[int]:
+        node = self.root
+        for char in query[:MAX_PREFIX_LENGTH]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if len(query) > MAX_PREFIX_LENGTH:
+            return [i for i in node.ids if query in self.labels[i]]
+        return node.ids
+
+    def search(self, query: str, limit: int = 20) -> list[DatalinkFieldOption]:
+        query = query.lower().strip()
+        if not query:
+            return [self.options[i] for i in self.ranked[:limit]]
+
+        prefix_ids = self._prefix_ids(query)
+        # whole-label prefix matches first, then word prefix matches; both already ordered by score
+        results = [i for i in prefix_ids if self.labels[i].startswith(query)]
+        results += [i for i in prefix_ids if not self.labels[i].startswith(query)]
+        results = results[:limit]
+
+        if len(results) < limit:
+            seen = set(prefix_ids)
+            fuzzy = []
+            for i in self.ranked:
+                if i in seen:
+                    continue
+                gaps = subsequence_gaps(query, self.labels[i])
+                if gaps is not None:
+                    fuzzy.append((gaps, -self.scores[i], i))
+            fuzzy.sort()
+            results += [i for _, _, i in fuzzy[: limit - len(results)]]
+
+        return [self.options[i] for i in results]
+
+
+def usage_scores(datalink_log: DatalinkLog, property_name: str, now: datetime | None = None) -> dict[str, float]:
+    """
+    Scores every value of `property_name` in the log by how often and how recently it was used;
+    each use contributes 0.5 ** (age in days / RECENCY_HALF_LIFE_DAYS).
+    """
+    if not os.path.exists(datalink_log.path):
+        return {}
+    now = now or datetime.now()
+    scores: dict[str, float] = {}
+    for row in datalink_log.get_rows():
+        value = row.get(property_name)
+        if not value:
+            continue
+        start = datetime.fromisoformat(row["start"])
+        if start.tzinfo is not None:
+            start = start.replace(tzinfo=None)
+        age_days = max((now - start).total_seconds() / 86400, 0)
+        scores[value] = scores.get(value, 0.0) + math.pow(0.5, age_days / RECENCY_HALF_LIFE_DAYS)
+    return scores
+
+
+def _mtime(path: str) -> float | None:
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def get_option_index(datalink_name: str, property_name: str) -> OptionIndex:
+    """
+    Returns the (cached) OptionIndex for a datalink property. The index is rebuilt whenever the
+    property's option source or the datalink log changes on disk.
+    """
+    spec = next((spec for spec in settings.get_event_datalinks() if spec.name == datalink_name), None)
+    if spec is None:
+        raise KeyError(f"Invalid event datalink name: {datalink_name}")
+    if property_name not in spec.properties:
+        raise KeyError(f"Invalid property {property_name} for event datalink {datalink_name}")
+
+    options = spec.properties[property_name].options
+    source_path = resolve_options_path(options) if isinstance(options, str) else None
+    datalink_log = DatalinkLog(spec)
+    signature = (
+        datalink_log.path,
+        source_path,
+        _mtime(source_path) if source_path else None,
+        _mtime(datalink_log.path),
+        None if source_path else tuple(option_label(option) for option in options),
+    )
+
+    with _OPTION_INDEXES_LOCK:
+        indexes = _OPTION_INDEXES.setdefault(current_account().name, OrderedDict())
+        cached = indexes.get((datalink_log.path, property_name))
+        if cached is not None and cached[0] == signature:
+            indexes.move_to_end((datalink_log.path, property_name))
+            return cached[1]
+
+    # the parsed options and usage scores are shared between workers, so only one of them reads the files
+    shared_key = f"options:{datalink_name}:{property_name}:{hashlib.sha256(repr(signature).encode()).hexdigest()}"
+    shared = get_shared_cache().get_json(shared_key)
+    if shared is not None:
+        options = [DatalinkFieldOption(**option) for option in shared["options"]]
+        usage = shared["usage"]
+    else:
+        if source_path is not None:
+            options = load_options_file(source_path)
+            if isinstance(options, str):
+                options = [DatalinkFieldOption(bigText=options, smallText="", value=options)]
+        usage = usage_scores(datalink_log, property_name)
+        get_shared_cache().set_json(
+            shared_key, {"options": [option.to_json() for option in options], "usage": usage}, ttl=SHARED_OPTIONS_TTL
+        )
+    # built outside the lock, so a slow build does not hold up lookups of other indexes
+    index = OptionIndex(options, usage)
+    with _OPTION_INDEXES_LOCK:
+        indexes[(datalink_log.path, property_name)] = (signature, index)
+        indexes.move_to_end((datalink_log.path, property_name))
+        while len(indexes) > MAX_OPTION_INDEXES:
+            indexes.popitem(last=False)
+    return index
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.accounts import current_account
+from app.events import Event
+from app.intervals import IntervalIndex
+from app.integrations.google_calendar import expand_calendar_items, list_calendar_items
+from app.integrations.series_cache import SeriesCache
+from app.shared_cache import CacheBackend, MemoryBackend, get_shared_cache
+
+
+class EventCache:
+    """
+    Caches the items listed from all calendars per requested range (single events, recurring masters and
+    exceptions), together with an IntervalIndex over their events, so conflict and free-slot queries (which the
+    UI makes while events are dragged) do not refetch from Google. Recurring series are kept once in `series`
+    and expanded into the range's instances on read, memoized per (series, range) by app.recurrence.
+
+    The events live in the shared cache backend, so with several workers each range is fetched from Google once
+    rather than once per worker; a cross-worker lock stops workers that miss at the same time from all fetching.
+    Entries expire after `ttl` seconds, and everything is invalidated when events are written through the app
+    (by bumping a generation number that is part of every key, which every worker sees on its next read).
+    """
+    def __init__(self, ttl=30, backend: CacheBackend | None = None, fill_timeout=10, namespace="", max_indexes=16):
+        self.ttl = ttl
+        self._backend = backend
+        self.fill_timeout = fill_timeout
+        self.prefix = f"events:{namespace}:" if namespace else "events:" # keeps accounts' events apart in a shared backend
+        # interval indexes are built locally, memoized by a digest of the events they were built from;
+        # the `max_indexes` most recently used ranges are kept
+        self.max_indexes = max_indexes
+        self.indexes: OrderedDict[tuple[str, str], tuple[str, IntervalIndex[Event]]] = OrderedDict()
+        self.series = SeriesCache(backend=backend, namespace=namespace)
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_shared_cache()
+
+    def _key(self, start: str, end: str) -> str:
+        generation = int(self.backend.get(f"{self.prefix}generation") or 0)
+        return f"{self.prefix}{generation}:{start}:{end}"
+
+    def _get_payload(self, service, start: str, end: str) -> bytes:
+        key = self._key(start, end)
+        payload = self.backend.get(key)
+        if payload is not None:
+            return payload
+        # only one worker fetches a missing range; the others wait for it to appear
+        if not self.backend.add(f"{key}:filling", b"1", ttl=self.fill_timeout):
+            deadline = time.time() + self.fill_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                payload = self.backend.get(key)
+                if payload is not None:
+                    return payload
+        try:
+            payload = json.dumps(list_calendar_items(service, start, end)).encode()
+            self.backend.set(key, payload, ttl=self.ttl)
+        finally:
+            self.backend.delete(f"{key}:filling")
+        return payload
+
+    def _events(self, service, start: str, end: str, payload: bytes) -> list[Event]:
+        return expand_calendar_items(service, json.loads(payload), start, end, self.series)
+
+    def get_events(self, service, start: str, end: str) -> list[Event]:
+        return self._events(service, start, end, self._get_payload(service, start, end))
+
+    def get_index(self, service, start: str, end: str) -> IntervalIndex[Event]:
+        """
+        Returns an IntervalIndex over the timed events in the range (all-day events are left out, since they
+        would conflict with everything on their day). The index is only rebuilt when the events change.
+        """
+        payload = self._get_payload(service, start, end)
+        digest = hashlib.sha256(payload).hexdigest()
+        cached = self.indexes.get((start, end))
+        if cached is not None and cached[0] == digest:
+            self.indexes.move_to_end((start, end))
+            return cached[1]
+        events = self._events(service, start, end, payload)
+        index = IntervalIndex([(event.start, event.end, event) for event in events if not event.is_all_day])
+        self.indexes[(start, end)] = (digest, index)
+        self.indexes.move_to_end((start, end))
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return index
+
+    def invalidate(self):
+        self.backend.incr(f"{self.prefix}generation")
+        self.series.invalidate()
+        self.indexes = OrderedDict()
+
+
+_EVENT_CACHES: dict[str, EventCache] = {}
+_EVENT_CACHES_LOCK = threading.Lock()
+
+def get_event_cache() -> EventCache:
+    """
+    The event cache of the current account. When the shared backend is in process memory (memory://), each
+    account's event payloads go in a backend of their own, bounded by the account's cache_bytes, so one
+    account's ranges cannot crowd out another's or grow memory without limit.
+    """
+    account = current_account()
+    with _EVENT_CACHES_LOCK:
+        if account.name not in _EVENT_CACHES:
+            backend = MemoryBackend(max_bytes=account.cache_bytes) if isinstance(get_shared_cache(), MemoryBackend) else None
+            _EVENT_CACHES[account.name] = EventCache(backend=backend, namespace=account.name)
+        return _EVENT_CACHES[account.name]
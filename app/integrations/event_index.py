@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytz
+
+from app.settings import settings
+
+
+def log_signature(datalink_log) -> str:
+    """Identifies the current contents of a datalink log (all its segments) by path, size and modification time."""
+    signature = []
+    for path in datalink_log.segment_paths() + [datalink_log.path]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return json.dumps(signature)
+
+
+ENTRY_COLUMNS = "event_id, datalink, row_id, start, stop, calendar, file"
+
+
+def timestamp(time: str) -> float:
+    parsed = datetime.fromisoformat(time)
+    if parsed.tzinfo is None:
+        parsed = pytz.utc.localize(parsed)
+    return parsed.timestamp()
+
+
+class EventIndex:
+    """
+    A persistent event_id -> (datalink, row) index over all datalink logs, kept in a SQLite database next to them.
+
+    Pushes record their rows here as they are written, so finding the datalink rows of an event never needs
+    a read of the logs. Each datalink's entries are stored with the signature of the log files they were
+    built from; if a log was changed behind the index's back (e.g. edited by hand), sync rebuilds that
+    datalink's entries from the log.
+
+    Entries also record the file of the log (current file or old segment) their row is in, so a change to a row
+    only needs to rewrite that file. Writers update the index while still holding the log's lock (DatalinkLog.lock), so the signature stored
+    with the entries is never that of a write the entries do not include.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self.local, "connection", None) is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "event_id TEXT, datalink TEXT, row_id TEXT, start REAL, stop REAL, calendar TEXT, file TEXT, "
+                "PRIMARY KEY (event_id, datalink))"
+            )
+            # indexes from before rows' files were recorded get the column; their entries have no file until rebuilt
+            if "file" not in [column[1] for column in connection.execute("PRAGMA table_info(entries)")]:
+                connection.execute("ALTER TABLE entries ADD COLUMN file TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_start ON entries (start)")
+            connection.execute("CREATE TABLE IF NOT EXISTS logs (datalink TEXT PRIMARY KEY, signature TEXT)")
+            connection.commit()
+            self.local.connection = connection
+        return self.local.connection
+
+    def sync(self, datalink_logs: list):
+        """Rebuilds the entries of every log whose files changed since the index last saw them."""
+        connection = self._connection()
+        for datalink_log in datalink_logs:
+            with datalink_log.lock:
+                row = connection.execute("SELECT signature FROM logs WHERE datalink = ?", (datalink_log.spec.name,)).fetchone()
+                if row is None or row[0] != log_signature(datalink_log):
+                    self.rebuild(datalink_log)
+
+    def rebuild(self, datalink_log):
+        connection = self._connection()
+        with datalink_log.lock, connection:
+            connection.execute("DELETE FROM entries WHERE datalink = ?", (datalink_log.spec.name,))
+            if os.path.exists(datalink_log.path):
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO entries ({ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self._entry(datalink_log.spec.name, row, file) for file, row in datalink_log.iter_file_rows()),
+                )
+            self._store_signature(connection, datalink_log)
+
+    def _entry(self, datalink_name: str, row: dict, file: str) -> tuple:
+        return (row["event_id"], datalink_name, row["id"], timestamp(row["start"]), timestamp(row["stop"]), row["calendar"], file)
+
+    def _store_signature(self, connection: sqlite3.Connection, datalink_log):
+        connection.execute(
+            "INSERT OR REPLACE INTO logs VALUES (?, ?)", (datalink_log.spec.name, log_signature(datalink_log))
+        )
+
+    def store_signature(self, datalink_log):
+        """Marks the index as up to date with the log, after a write the index was told about (or that kept all rows)."""
+        connection = self._connection()
+        with connection:
+            self._store_signature(connection, datalink_log)
+
+    def record_rows(self, datalink_log, rows: list[dict]):
+        """Records rows that were just added to (or updated in) a log, which writes them to its current file."""
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO entries ({ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._entry(datalink_log.spec.name, row, os.path.basename(datalink_log.path)) for row in rows),
+            )
+            self._store_signature(connection, datalink_log)
+
+    def move_file(self, datalink_log, old_file: str, new_file: str):
+        """Records that the rows of one file of a log were moved to another (e.g. by DatalinkLog.migrate_segment)."""
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "UPDATE entries SET file = ? WHERE datalink = ? AND file = ?", (new_file, datalink_log.spec.name, old_file)
+            )
+            self._store_signature(connection, datalink_log)
+
+    def files_of(self, datalink_log, event_ids: list[str]) -> dict[str, str]:
+        """The file of the log each of `event_ids` has its row in, where known."""
+        files = {}
+        connection = self._connection()
+        for i in range(0, len(event_ids), 500):
+            chunk = event_ids[i:i + 500]
+            rows = connection.execute(
+                f"SELECT event_id, file FROM entries WHERE datalink = ? AND file IS NOT NULL "
+                f"AND event_id IN ({', '.join('?' * len(chunk))})",
+                [datalink_log.spec.name, *chunk],
+            ).fetchall()
+            files.update(rows)
+        return files
+
+    def apply_changes(self, datalink_log, changes: dict[str, dict | None], files: dict[str, str] | None = None):
+        """
+        Mirrors DatalinkLog.apply_event_changes: None removes an event's entry, otherwise start/stop/event_id are
+        updated, along with the file the row was found in (from `files`, as returned by apply_event_changes).
+        """
+        connection = self._connection()
+        with connection:
+            for event_id, change in changes.items():
+                if change is None:
+                    connection.execute(
+                        "DELETE FROM entries WHERE event_id = ? AND datalink = ?", (event_id, datalink_log.spec.name)
+                    )
+                    continue
+                if files and event_id in files:
+                    connection.execute(
+                        "UPDATE entries SET file = ? WHERE event_id = ? AND datalink = ?",
+                        (files[event_id], event_id, datalink_log.spec.name),
+                    )
+                for column in ("start", "stop"):
+                    if column in change:
+                        connection.execute(
+                            f"UPDATE entries SET {column} = ? WHERE event_id = ? AND datalink = ?",
+                            (timestamp(change[column]), event_id, datalink_log.spec.name),
+                        )
+                if "event_id" in change:
+                    connection.execute(
+                        "UPDATE OR REPLACE entries SET event_id = ? WHERE event_id = ? AND datalink = ?",
+                        (change["event_id"], event_id, datalink_log.spec.name),
+                    )
+            self._store_signature(connection, datalink_log)
+
+    def lookup(self, event_id: str) -> list[tuple[str, str]]:
+        """The (datalink name, row id) of every datalink row for the event."""
+        return self._connection().execute(
+            "SELECT datalink, row_id FROM entries WHERE event_id = ?", (event_id,)
+        ).fetchall()
+
+    def datalinks_of(self, event_ids: list[str]) -> dict[str, set[str]]:
+        """The names of the datalinks with a row for each of `event_ids` (events without rows are left out)."""
+        datalinks = {}
+        connection = self._connection()
+        # in chunks, to stay under SQLite's limit on query parameters
+        for i in range(0, len(event_ids), 500):
+            chunk = event_ids[i:i + 500]
+            rows = connection.execute(
+                f"SELECT event_id, datalink FROM entries WHERE event_id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for event_id, datalink in rows:
+                datalinks.setdefault(event_id, set()).add(datalink)
+        return datalinks
+
+    def entries_between(self, start: datetime, end: datetime) -> list[dict]:
+        rows = self._connection().execute(
+            "SELECT event_id, datalink, row_id, start, stop, calendar FROM entries WHERE start >= ? AND start < ? ORDER BY start",
+            (start.timestamp(), end.timestamp()),
+        ).fetchall()
+        return [
+            {
+                "event_id": event_id,
+                "datalink_name": datalink,
+                "id": row_id,
+                "start": datetime.fromtimestamp(row_start, pytz.utc).isoformat(),
+                "stop": datetime.fromtimestamp(row_stop, pytz.utc).isoformat(),
+                "calendar": calendar,
+            }
+            for event_id, datalink, row_id, row_start, row_stop, calendar in rows
+        ]
+
+
+_EVENT_INDEXES: dict[str, EventIndex] = {}
+
+def get_event_index() -> EventIndex:
+    """The index for the current datapath, stored as {datapath}/.event_index.db."""
+    path = os.path.join(settings.get_datapath(), ".event_index.db")
+    if path not in _EVENT_INDEXES:
+        _EVENT_INDEXES[path] = EventIndex(path)
+    return _EVENT_INDEXES[path]
@@ -1,14 +1,27 @@
+import heapq
 import logging
+import threading
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Iterator
+import httplib2
+import pytz
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from google.auth.exceptions import RefreshError
 from tenacity import retry, stop_after_attempt, wait_exponential
 import os
+from app.accounts import Account, current_account, get_accounts
 from app.events import Event
+from app.integrations.series_cache import SeriesCache
+from app.recurrence import expand_gcal_events
 from app.settings import settings
+from app.shared_cache import MemoryBackend
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,10 +29,22 @@ logger = logging.getLogger(__name__)
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
 
+def upstream_slot():
+    """Waits for the current account's turn to call Google (see app.scheduling.FairScheduler)."""
+    return get_accounts().scheduler.slot(current_account().name)
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def make_api_call(func, *args, **kwargs):
     try:
-        return func(*args, **kwargs)
+        # each attempt queues for a slot again, so retries do not hold one while backing off
+        with upstream_slot():
+            return func(*args, **kwargs)
+    except RefreshError as e:
+        # the account's credentials can no longer be refreshed; rebuild its service (and credentials) next time
+        logger.error(f"Credentials of account {current_account().name} could not be refreshed: {e}")
+        service_pool.discard(current_account())
+        raise
     except HttpError as e:
         logger.error(f"HTTP Error occurred: {e}")
         raise
@@ -28,18 +53,69 @@ def make_api_call(func, *args, **kwargs):
         raise
 
 
+class ServicePool:
+    """
+    One long-lived Calendar service per account, built on first use, so the discovery document is fetched
+    and parsed once per account rather than once per request.
+
+    A service is shared by every thread: its requests are built with a per-thread HTTP connection (httplib2
+    connections are not thread-safe), and AuthorizedHttp refreshes the account's credentials when they expire.
+    Services are built under a lock of their own account only, since loading credentials can mean a token
+    refresh or even an interactive login, which must not hold up the other accounts.
+    """
+    def __init__(self):
+        self.services = {}
+        self.account_locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock() # guards the two dicts only
+
+    def _build(self, account: Account):
+        creds = load_or_refresh_credentials(account.oauth_path, account.credentials_path)
+        local = threading.local()
+
+        def http():
+            if getattr(local, "http", None) is None:
+                local.http = AuthorizedHttp(creds, http=httplib2.Http())
+            return local.http
+
+        def build_request(_, *args, **kwargs):
+            return HttpRequest(http(), *args, **kwargs)
+
+        return build("calendar", "v3", http=http(), requestBuilder=build_request)
+
+    def get(self, account: Account):
+        with self.lock:
+            service = self.services.get(account.name)
+            if service is not None:
+                return service
+            account_lock = self.account_locks.setdefault(account.name, threading.Lock())
+        with account_lock:
+            with self.lock:
+                service = self.services.get(account.name)
+            if service is None:
+                # built outside the pool lock, so other accounts' get calls are not blocked
+                service = self._build(account)
+                with self.lock:
+                    self.services[account.name] = service
+            return service
+
+    def discard(self, account: Account):
+        """Drops the account's service (e.g. after its credentials were revoked), so the next get rebuilds it."""
+        with self.lock:
+            self.services.pop(account.name, None)
+
+
+service_pool = ServicePool()
+
 def get_service():
-    creds = load_or_refresh_credentials()
-    service = build("calendar", "v3", credentials=creds)
-    return service
+    return service_pool.get(current_account())
 
 
 
-def load_or_refresh_credentials():
+def load_or_refresh_credentials(oauth_path="oauth.json", credentials_path="credentials.json"):
     creds = None
-    if os.path.exists("oauth.json"):
-        print("Found oauth.json")
-        creds = Credentials.from_authorized_user_file("oauth.json", SCOPES)
+    if os.path.exists(oauth_path):
+        print(f"Found {oauth_path}")
+        creds = Credentials.from_authorized_user_file(oauth_path, SCOPES)
     if not creds or not creds.valid:
         print("Credentials not valid")
         if creds and creds.expired and creds.refresh_token:
@@ -52,11 +128,11 @@ def load_or_refresh_credentials():
         
         if not creds:
             print("Creating new credentials")
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
         
         # Save the credentials for the next run
-        with open("oauth.json", "w") as token:
+        with open(oauth_path, "w") as token:
             token.write(creds.to_json())
     
     return creds
@@ -84,36 +160,184 @@ def get_calendar_colors(service, calendar_ids):
         return None
 
 
-def get_events(service, start: str, end: str) -> list[Event]:
-    all_events = []
+def list_events_request(service, calendar_id: str, start: str, end: str, page_token=None):
+    # recurring series come back once, as masters plus exceptions, and are expanded locally (see app.recurrence);
+    # cancelled instances are listed as exceptions without showDeleted, as long as singleEvents is False
+    return service.events().list(
+        calendarId=calendar_id,
+        timeMin=start,
+        timeMax=end,
+        singleEvents=False,
+        pageToken=page_token,
+    )
+
+
+def list_series_request(service, calendar_id: str, ical_uid: str, page_token=None):
+    # every event of a series shares its iCalUID, so this lists the master and all its exceptions, wherever they are now
+    return service.events().list(
+        calendarId=calendar_id,
+        iCalUID=ical_uid,
+        singleEvents=False,
+        fields="items(id,status,summary,start,end,recurringEventId,originalStartTime),nextPageToken",
+        pageToken=page_token,
+    )
+
+
+def fetch_pages(service, requests: dict[str, Callable[..., HttpRequest]]) -> dict[str, list[dict]]:
+    """
+    Fetches the items of every request in `requests` (keyed by name, each called with a page token): the first
+    pages in one batch, then any further pages one request at a time. Requests that fail are logged and left out.
+    """
+    names = list(requests)
+    items: dict[str, list[dict]] = {}
+    next_page_tokens: dict[str, str] = {}
 
     def batch_callback(request_id, response, exception):
+        name = names[int(request_id)]
         if exception is not None:
-            logger.error(
-                f"Error fetching events for calendar {request_id}: {exception}"
-            )
+            logger.error(f"Error fetching events for {name}: {exception}")
         else:
-            calendar_name = request_id  # Using request_id to track calendar name
-            all_events.extend(
-                [
-                    Event.from_gcal_event(event, calendar_name)
-                    for event in response.get("items", [])
-                ]
-            )
+            items[name] = response.get("items", [])
+            if response.get("nextPageToken"):
+                next_page_tokens[name] = response["nextPageToken"]
 
+    if not names:
+        return items
     batch = service.new_batch_http_request(callback=batch_callback)
+    for i, name in enumerate(names):
+        batch.add(requests[name](), request_id=str(i))
 
-    for calendar_name, calendar_id in settings.get_calendar_ids().items():
-        batch.add(
-            service.events().list(
-                calendarId=calendar_id,
-                timeMin=start,
-                timeMax=end,
-                singleEvents=True,
-                orderBy="startTime",
-            ),
-            request_id=calendar_name,  # Use calendar name as request ID
-        )
-
-    batch.execute()
+    try:
+        with upstream_slot():
+            batch.execute()
+    except RefreshError:
+        service_pool.discard(current_account())
+        raise
+
+    # requests with more than one page of items are finished off one request at a time
+    for name, page_token in next_page_tokens.items():
+        while page_token:
+            response = make_api_call(requests[name](page_token=page_token).execute)
+            items[name].extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+    return items
+
+
+def list_calendar_items(service, start: str, end: str) -> dict[str, list[dict]]:
+    """The items (single events, recurring masters and exceptions) listed for each calendar between start and end."""
+    return fetch_pages(service, {
+        calendar_name: partial(list_events_request, service, calendar_id, start, end)
+        for calendar_name, calendar_id in settings.get_calendar_ids().items()
+    })
+
+
+def load_series(service, items: dict[str, list[dict]], series_cache: SeriesCache) -> dict[str, list[dict]]:
+    """
+    Returns calendar name -> the items of every recurring series among `items` (calendar name -> listed items),
+    from `series_cache`; only series not cached at their master's current version are fetched, in one batch.
+    """
+    series: dict[str, list[dict]] = {calendar_name: [] for calendar_name in items}
+    missing: dict[str, tuple[str, dict]] = {}
+    for calendar_name, calendar_items in items.items():
+        for master in calendar_items:
+            if "recurrence" not in master or master.get("status") == "cancelled" or "iCalUID" not in master:
+                continue
+            cached = series_cache.get(calendar_name, master)
+            if cached is None:
+                missing[f"{calendar_name}/{master['id']}"] = (calendar_name, master)
+            else:
+                series[calendar_name].extend(cached)
+    if not missing:
+        return series
+
+    calendar_ids = settings.get_calendar_ids()
+    fetched = fetch_pages(service, {
+        key: partial(list_series_request, service, calendar_ids[calendar_name], master["iCalUID"])
+        for key, (calendar_name, master) in missing.items()
+    })
+    for key, series_items in fetched.items():
+        calendar_name, master = missing[key]
+        series_cache.set(calendar_name, master, series_items)
+        series[calendar_name].extend(series_items)
+    return series
+
+
+def expand_calendar_items(service, items: dict[str, list[dict]], start: str, end: str, series_cache: SeriesCache) -> list[Event]:
+    """
+    Turns the items listed for each calendar between start and end into the events shown there, expanding
+    recurring series locally from their cached exceptions (see load_series and app.recurrence).
+    """
+    series = load_series(service, items, series_cache)
+    all_events = []
+    for calendar_name, calendar_items in items.items():
+        # An exception moved out of the window is not listed for it, but its instance's original time may still be
+        # in the window, where the master would otherwise expand it a second time; the exceptions of the cached
+        # series are added so expand_gcal_events drops those instances. Listed exceptions are the more recent.
+        listed = {item["id"] for item in calendar_items}
+        moved = [
+            item for item in series[calendar_name]
+            if "recurringEventId" in item and item["id"] not in listed
+        ]
+        all_events.extend(expand_gcal_events(calendar_items + moved, calendar_name, start, end))
     return all_events
+
+
+def get_events(service, start: str, end: str, series_cache: SeriesCache | None = None) -> list[Event]:
+    series_cache = series_cache or SeriesCache(backend=MemoryBackend())
+    return expand_calendar_items(service, list_calendar_items(service, start, end), start, end, series_cache)
+
+
+def event_sort_key(timezone):
+    # all-day events (which have naive starts) are ordered as if they started at midnight in `timezone`
+    def sort_key(event: Event):
+        if event.start.tzinfo is None:
+            return timezone.localize(event.start)
+        return event.start
+    return sort_key
+
+
+def iter_calendar_events(
+    service,
+    calendar_name: str,
+    calendar_id: str,
+    start: str,
+    end: str,
+    timezone=pytz.utc,
+    series_cache: SeriesCache | None = None,
+    window_days=28,
+) -> Iterator[Event]:
+    """
+    Lazily yields the events of one calendar between start and end in start time order. The range is listed
+    one window of `window_days` at a time (recurring series once each, as masters and exceptions, expanded
+    locally from `series_cache`), so only one window's events are held in memory at a time.
+    """
+    series_cache = series_cache or SeriesCache(backend=MemoryBackend())
+    sort_key = event_sort_key(timezone)
+    range_end = datetime.fromisoformat(end)
+    window_start = datetime.fromisoformat(start)
+    first_window = True
+    while window_start < range_end:
+        window_end = min(window_start + timedelta(days=window_days), range_end)
+        items = fetch_pages(service, {
+            calendar_name: partial(list_events_request, service, calendar_id, window_start.isoformat(), window_end.isoformat())
+        })
+        events = expand_calendar_items(service, items, window_start.isoformat(), window_end.isoformat(), series_cache)
+        # events overlapping the window that began in an earlier one were already yielded with it
+        events = [event for event in events if first_window or sort_key(event) >= window_start]
+        yield from sorted(events, key=sort_key)
+        window_start = window_end
+        first_window = False
+
+
+def iter_events(service, start: str, end: str, timezone=pytz.utc, series_cache: SeriesCache | None = None) -> Iterator[Event]:
+    """
+    Lazily yields the events of all calendars in settings between start and end, merged in start time order.
+    Only one window per calendar is held in memory at a time (see iter_calendar_events). All-day events
+    (which have naive starts) are ordered as if they started at midnight in `timezone`.
+    """
+    series_cache = series_cache or SeriesCache(backend=MemoryBackend())
+    calendar_iterators = [
+        iter_calendar_events(service, calendar_name, calendar_id, start, end, timezone, series_cache)
+        for calendar_name, calendar_id in settings.get_calendar_ids().items()
+    ]
+    return heapq.merge(*calendar_iterators, key=event_sort_key(timezone))
@@ -0,0 +1,35 @@
+from app.shared_cache import CacheBackend, get_shared_cache
+
+
+class SeriesCache:
+    """
+    Keeps recurring series (the master event and all its exceptions, as listed by iCalUID) in the shared cache,
+    keyed by the master's id and last update time, so each version of a series is fetched from Google once
+    however many ranges it shows up in; the instances of a range are then expanded locally from the cached series.
+
+    A windowed listing only returns the exceptions that are in the window now, so the series is what shows that an
+    instance in the window was moved elsewhere. Writes through the app invalidate every series (by bumping a
+    generation number that is part of every key), since they can move instances without touching the master.
+    """
+    def __init__(self, ttl=24 * 3600, backend: CacheBackend | None = None, namespace=""):
+        self.ttl = ttl
+        self._backend = backend
+        self.prefix = f"series:{namespace}:" if namespace else "series:"
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_shared_cache()
+
+    def _key(self, calendar: str, master: dict) -> str:
+        generation = int(self.backend.get(f"{self.prefix}generation") or 0)
+        return f"{self.prefix}{generation}:{calendar}:{master['id']}:{master.get('updated', '')}"
+
+    def get(self, calendar: str, master: dict) -> list[dict] | None:
+        """The items of the series at the master's current version, or None if they are not cached."""
+        return self.backend.get_json(self._key(calendar, master))
+
+    def set(self, calendar: str, master: dict, items: list[dict]):
+        self.backend.set_json(self._key(calendar, master), items, ttl=self.ttl)
+
+    def invalidate(self):
+        self.backend.incr(f"{self.prefix}generation")
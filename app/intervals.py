@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from typing import Generic, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class IntervalIndex(Generic[T]):
+    """
+    A static augmented interval tree over half-open intervals [start, end).
+
+    Intervals are sorted by start and the tree is implicit in that array: the root of the range [lo, hi) is
+    its middle element, and max_end[mid] is the greatest end in [lo, hi). An overlap query skips every subtree
+    whose max_end is before the query start and every right subtree whose first start is after the query end,
+    so it runs in O(log n + k) for k results.
+    """
+    def __init__(self, intervals: list[tuple[datetime, datetime, T]]):
+        self.intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.starts = [interval[0] for interval in self.intervals]
+        self.max_end: list[datetime | None] = [None] * len(self.intervals)
+        self._build(0, len(self.intervals))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _build(self, lo: int, hi: int) -> datetime | None:
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.intervals[mid][1]
+        for child_max in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child_max is not None and child_max > max_end:
+                max_end = child_max
+        self.max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start: datetime, end: datetime) -> list[tuple[datetime, datetime, T]]:
+        """Returns the intervals overlapping [start, end), in start order."""
+        return [self.intervals[i] for i in self._overlapping(0, len(self.intervals), start, end)]
+
+    def _overlapping(self, lo: int, hi: int, start: datetime, end: datetime) -> Iterator[int]:
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_end[mid] <= start:
+            return # nothing in this subtree ends after the query starts
+        yield from self._overlapping(lo, mid, start, end)
+        if self.starts[mid] >= end:
+            return # this interval and everything to its right starts after the query ends
+        if self.intervals[mid][1] > start:
+            yield mid
+        yield from self._overlapping(mid + 1, hi, start, end)
+
+    def conflicts(self) -> list[tuple[T, T]]:
+        """Returns every pair of overlapping intervals, each pair once with the earlier-starting interval first."""
+        pairs = []
+        for i, (start, end, item) in enumerate(self.intervals):
+            for j in self._overlapping(0, len(self.intervals), start, end):
+                if j > i:
+                    pairs.append((item, self.intervals[j][2]))
+        return pairs
+
+    def free_slots(self, start: datetime, end: datetime, min_duration: timedelta) -> list[tuple[datetime, datetime]]:
+        """Returns the gaps of at least `min_duration` within [start, end) not covered by any interval."""
+        slots = []
+        cursor = start
+        for busy_start, busy_end, _ in self.overlapping(start, end):
+            if busy_start - cursor >= min_duration:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if end - cursor >= min_duration:
+            slots.append((cursor, end))
+        return slots
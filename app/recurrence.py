@@ -0,0 +1,174 @@
+"""
+Local expansion of Google Calendar recurring events.
+
+Instead of asking Google to expand every recurring series into instances (singleEvents=True), events are
+listed with singleEvents=False, which returns each series once as a master event with RRULE/EXDATE/RDATE lines,
+plus its exceptions (modified or cancelled instances, which carry a recurringEventId). The instances of a
+series in a window are then computed here, and memoized per (series, window) so each week is only expanded once.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+from dateutil.rrule import rruleset, rrulestr
+
+from app.events import Event
+
+
+def localize(tz, naive: datetime) -> datetime:
+    if hasattr(tz, "localize"):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def to_local_naive(time: datetime, tz) -> datetime:
+    return time.astimezone(tz).replace(tzinfo=None)
+
+
+def parse_ical_time(value: str, params: dict[str, str], tz, default_time) -> datetime:
+    """Parses an iCalendar DATE or DATE-TIME value into a naive datetime in the series' local time."""
+    if len(value) == 8: # DATE
+        return datetime.combine(datetime.strptime(value, "%Y%m%d").date(), default_time)
+    if value.endswith("Z"):
+        time = pytz.utc.localize(datetime.strptime(value, "%Y%m%dT%H%M%SZ"))
+        return to_local_naive(time, tz) if tz is not None else time.replace(tzinfo=None)
+    time = datetime.strptime(value, "%Y%m%dT%H%M%S")
+    if "TZID" in params and tz is not None:
+        return to_local_naive(pytz.timezone(params["TZID"]).localize(time), tz)
+    return time
+
+
+def parse_recurrence_line(line: str) -> tuple[str, dict[str, str], str]:
+    """Splits e.g. "EXDATE;TZID=Europe/London:20240101T100000" into ("EXDATE", {"TZID": "Europe/London"}, "20240101T100000")."""
+    head, _, value = line.partition(":")
+    name, *params = head.split(";")
+    return name.upper(), dict(param.split("=", 1) for param in params), value
+
+
+def build_rruleset(recurrence: tuple[str, ...], dtstart: datetime, tz) -> rruleset:
+    """
+    Builds a dateutil rruleset over naive local times. Times are kept naive (and only localized per instance)
+    so that instances keep their wall-clock time across DST changes, like Google expands them.
+    """
+    rules = rruleset()
+    for line in recurrence:
+        name, params, value = parse_recurrence_line(line)
+        if name == "RRULE":
+            # dateutil refuses a UTC UNTIL with a naive DTSTART, so UNTIL is converted to local time first
+            def local_until(match):
+                until = parse_ical_time(match.group(1), {}, tz, datetime.max.time().replace(microsecond=0))
+                return "UNTIL=" + until.strftime("%Y%m%dT%H%M%S")
+            value = re.sub(r"UNTIL=([0-9TZ]+)", local_until, value)
+            rules.rrule(rrulestr(value, dtstart=dtstart))
+        elif name in ("EXDATE", "RDATE"):
+            for time in value.split(","):
+                parsed = parse_ical_time(time, params, tz, dtstart.time())
+                if name == "EXDATE":
+                    rules.exdate(parsed)
+                else:
+                    rules.rdate(parsed)
+    return rules
+
+
+def instance_id(master_id: str, original_start: datetime, is_all_day: bool) -> str:
+    # the same format Google uses for instance ids, so instances can be updated and datalinked by id
+    if is_all_day:
+        return f"{master_id}_{original_start.strftime('%Y%m%d')}"
+    return f"{master_id}_{original_start.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+
+def exception_instance_id(exception: dict) -> str:
+    """The id of the instance an exception overrides, worked out from its original start time."""
+    original = exception.get("originalStartTime")
+    if original is None:
+        return exception["id"]
+    if "date" in original:
+        return instance_id(exception["recurringEventId"], datetime.fromisoformat(original["date"]), True)
+    return instance_id(exception["recurringEventId"], datetime.fromisoformat(original["dateTime"]), False)
+
+
+@lru_cache(maxsize=4096)
+def expand_series(master_id: str, updated: str, recurrence: tuple[str, ...], start: str, end: str, tz_name: str | None,
+                  window_start: str, window_end: str) -> tuple[tuple[datetime, datetime, str], ...]:
+    """
+    Returns (start, end, instance id) for every instance of a series overlapping [window_start, window_end).
+    Memoized on the series (its id and last update time) and the window; the remaining arguments are
+    determined by those, but are passed explicitly so the function stays pure.
+    """
+    is_all_day = "T" not in start
+    tz = pytz.timezone(tz_name) if tz_name else (datetime.fromisoformat(start).tzinfo if not is_all_day else None)
+    if is_all_day:
+        dtstart = datetime.fromisoformat(start)
+        duration = datetime.fromisoformat(end) - dtstart
+        after = datetime.fromisoformat(window_start).replace(tzinfo=None) - duration
+        before = datetime.fromisoformat(window_end).replace(tzinfo=None)
+    else:
+        dtstart = to_local_naive(datetime.fromisoformat(start), tz)
+        duration = datetime.fromisoformat(end) - datetime.fromisoformat(start)
+        after = to_local_naive(datetime.fromisoformat(window_start), tz) - duration
+        before = to_local_naive(datetime.fromisoformat(window_end), tz)
+
+    instances = []
+    for occurrence in build_rruleset(recurrence, dtstart, tz).between(after, before):
+        occurrence_start = occurrence if is_all_day else localize(tz, occurrence)
+        instances.append((occurrence_start, occurrence_start + duration, instance_id(master_id, occurrence_start, is_all_day)))
+    return tuple(instances)
+
+
+def overlaps(event: Event, window_start: datetime, window_end: datetime) -> bool:
+    if event.is_all_day:
+        window_start, window_end = window_start.replace(tzinfo=None), window_end.replace(tzinfo=None)
+    return event.start < window_end and event.end > window_start
+
+
+def expand_gcal_events(items: list[dict], calendar: str, window_start: str, window_end: str) -> list[Event]:
+    """
+    Turns the items of an events().list(singleEvents=False) response into the Events shown in the window:
+    single events as they are, recurring masters expanded into their instances, and exceptions replacing
+    (or, if cancelled, removing) the instances they override. Exceptions outside the window are only used
+    to drop the instances they override, so `items` should include those of series expanded in the window
+    wherever they were moved to (see expand_calendar_items in app.integrations.google_calendar).
+    """
+    masters = [item for item in items if "recurrence" in item and item.get("status") != "cancelled"]
+    exceptions: dict[str, dict] = {}
+    events = []
+    for item in items:
+        if "recurringEventId" in item:
+            exceptions[exception_instance_id(item)] = item
+        elif "recurrence" not in item and item.get("status") != "cancelled":
+            events.append(Event.from_gcal_event(item, calendar))
+
+    for master in masters:
+        is_all_day = "date" in master["start"]
+        instances = expand_series(
+            master["id"],
+            master.get("updated", ""),
+            tuple(master["recurrence"]),
+            master["start"].get("date") or master["start"]["dateTime"],
+            master["end"].get("date") or master["end"]["dateTime"],
+            master["start"].get("timeZone"),
+            window_start,
+            window_end,
+        )
+        for start, end, event_id in instances:
+            if event_id in exceptions:
+                continue # replaced by (or cancelled through) an exception
+            events.append(Event(
+                calendar=calendar,
+                start=start,
+                end=end,
+                summary=master.get("summary", "[Google Calendar event with no title]"),
+                event_id=event_id,
+                is_all_day=is_all_day,
+            ))
+
+    # exceptions can be moved into the window from an original time outside it, so they are checked on their own
+    start, end = datetime.fromisoformat(window_start), datetime.fromisoformat(window_end)
+    for exception in exceptions.values():
+        if exception.get("status") == "cancelled":
+            continue
+        event = Event.from_gcal_event(exception, calendar)
+        if overlaps(event, start, end):
+            events.append(event)
+    return events
@@ -0,0 +1,187 @@
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable
+
+from app.accounts import current_account
+from app.shared_cache import InvalidationChannel
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, week_start: datetime, week_end: datetime, event_ids: set[str]):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.week_start = week_start
+        self.week_end = week_end
+        self.event_ids = event_ids # the events in the response, so writes to them can find it
+        self.created = time.time()
+        self.size = len(body) + sum(len(event_id) for event_id in event_ids)
+
+    def age(self) -> float:
+        return time.time() - self.created
+
+
+class ResponseCache:
+    """
+    An LRU cache of serialized JSON responses keyed by (endpoint, week start, timezone), bounded to `max_bytes`.
+
+    Entries younger than `fresh_for` seconds are served as they are. Older entries, up to `stale_for` seconds,
+    are still served immediately while a background thread recomputes them. Entries that are older still, or
+    missing, are computed in the request; if that fails (e.g. Google is briefly unavailable), whatever entry
+    there is gets served instead of an error.
+
+    Writes invalidate exactly the entries they affect: those whose week overlaps the written event's time,
+    and those that contain the event (which covers events moved out of a week). With a `channel`, invalidations
+    are also published to the response caches of the other workers, which apply them before their next read.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, fresh_for=30, stale_for=600, channel: InvalidationChannel | None = None):
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self.size = 0
+        self.revalidating: set[tuple] = set()
+        self.lock = threading.Lock()
+        self.channel = channel
+        # bumped by every invalidation of an endpoint, so results computed from data read before it are not stored
+        self.generations: dict[str, int] = {}
+
+    def _apply_remote_invalidations(self):
+        if self.channel is None:
+            return
+        messages = self.channel.poll()
+        if messages is None:
+            # this worker missed some invalidations, so nothing it has can be trusted
+            self.clear()
+            return
+        for message in messages:
+            self._invalidate_local(
+                message["endpoint"],
+                set(message["event_ids"]),
+                [(datetime.fromisoformat(start), datetime.fromisoformat(end)) for start, end in message["times"]],
+            )
+
+    def _store(self, key: tuple, entry: CachedResponse, generation: int):
+        with self.lock:
+            if self.generations.get(key[0], 0) != generation:
+                # the endpoint was invalidated while this was computed, so it may predate the write
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key).size
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def _compute(self, key: tuple, compute: Callable[[], Any], week_start: datetime, week_end: datetime) -> CachedResponse:
+        with self.lock:
+            generation = self.generations.get(key[0], 0)
+        data = compute()
+        body = json.dumps(data).encode()
+        entry = CachedResponse(body, week_start, week_end, response_event_ids(data))
+        self._store(key, entry, generation)
+        return entry
+
+    def _revalidate(self, key: tuple, compute: Callable[[], Any], week_start: datetime, week_end: datetime):
+        try:
+            self._compute(key, compute, week_start, week_end)
+        except Exception as e:
+            print(f"Error revalidating cached response {key}: {e}")
+        finally:
+            with self.lock:
+                self.revalidating.discard(key)
+
+    def get(self, key: tuple, compute: Callable[[], Any], week_start: datetime, week_end: datetime) -> CachedResponse:
+        """
+        Returns the cached response for `key`, computing it with `compute` (which returns JSON-serializable data)
+        if needed. `compute` may be run in a background thread, so it must not use the Flask request.
+        """
+        self._apply_remote_invalidations()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if entry.age() > self.fresh_for and entry.age() <= self.stale_for and key not in self.revalidating:
+                    self.revalidating.add(key)
+                    # in a copy of this context, so `compute` runs as the same account
+                    threading.Thread(
+                        target=contextvars.copy_context().run, args=(self._revalidate, key, compute, week_start, week_end), daemon=True
+                    ).start()
+
+        if entry is not None and entry.age() <= self.stale_for:
+            return entry
+        try:
+            return self._compute(key, compute, week_start, week_end)
+        except Exception:
+            if entry is not None:
+                print(f"Serving response for {key} from {int(entry.age())} seconds ago, as recomputing it failed")
+                return entry
+            raise
+
+    def invalidate(self, endpoint: str, event_ids=(), times: list[tuple[datetime, datetime]] = ()):
+        """Drops the entries of `endpoint` that contain any of `event_ids` or whose week overlaps any of `times`."""
+        event_ids, times = list(event_ids), list(times)
+        self._invalidate_local(endpoint, set(event_ids), times)
+        if self.channel is not None:
+            self.channel.publish({
+                "endpoint": endpoint,
+                "event_ids": event_ids,
+                "times": [(start.isoformat(), end.isoformat()) for start, end in times],
+            })
+
+    def _invalidate_local(self, endpoint: str, event_ids: set[str], times: list[tuple[datetime, datetime]]):
+        with self.lock:
+            self.generations[endpoint] = self.generations.get(endpoint, 0) + 1
+            for key in list(self.entries):
+                entry = self.entries[key]
+                if key[0] != endpoint:
+                    continue
+                if entry.event_ids & event_ids or any(
+                    start <= entry.week_end and end >= entry.week_start for start, end in times
+                ):
+                    self.size -= self.entries.pop(key).size
+
+    def clear(self):
+        with self.lock:
+            self.generations = {endpoint: generation + 1 for endpoint, generation in self.generations.items()}
+            self.entries = OrderedDict()
+            self.size = 0
+
+
+def response_event_ids(data) -> set[str]:
+    """The ids of the events in a weekly_events (list of events) or weekly_event_datalinks (datalink name -> list) response."""
+    if isinstance(data, dict):
+        items = [item for items in data.values() if isinstance(items, list) for item in items]
+    elif isinstance(data, list):
+        items = data
+    else:
+        return set()
+    event_ids = set()
+    for item in items:
+        if isinstance(item, dict):
+            event_id = item.get("id") or (item.get("event") or {}).get("id")
+            if event_id:
+                event_ids.add(event_id)
+    return event_ids
+
+
+_RESPONSE_CACHES: dict[str, ResponseCache] = {}
+_RESPONSE_CACHES_LOCK = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    """
+    The response cache of the current account. Accounts never share entries, and each cache is bounded by its
+    account's cache_bytes, so one account's traffic cannot evict another's responses.
+    """
+    account = current_account()
+    with _RESPONSE_CACHES_LOCK:
+        if account.name not in _RESPONSE_CACHES:
+            _RESPONSE_CACHES[account.name] = ResponseCache(
+                max_bytes=account.cache_bytes, channel=InvalidationChannel(f"responses:{account.name}")
+            )
+        return _RESPONSE_CACHES[account.name]
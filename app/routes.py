@@ -1,17 +1,23 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import traceback
-from app.integrations.datalink import parsed_event_datalink_specs, pull_from_event_datalinks, push_to_event_datalinks, EventDatalink
-from flask import render_template, jsonify, request
+import json
+from app.integrations.datalink import cascade_event_changes, find_orphaned_datalink_rows, parsed_event_datalink_specs, pull_from_event_datalinks, push_to_event_datalinks, EventDatalink
+from app.integrations.datalink_options import MAX_SEARCH_LIMIT, get_option_index
+from app.backfill import backfill_records
+from app.export import EXPORT_FORMATS, export_records, parse_export_bound, serialize_records
+from flask import Response, g, render_template, jsonify, redirect, request, session, stream_with_context
 import pytz
 from app.structs import EventObj, convert_event_obj
 
 from app.utils import week_start_end
 from app.integrations.google_calendar import (
     get_calendar_colors,
-    get_events,
     get_service,
     make_api_call,
 )
+from app.integrations.event_cache import get_event_cache
+from app.response_cache import CachedResponse, get_response_cache
+from app.accounts import activate_account, current_account, deactivate_account, get_accounts, using_account
 from app.settings import settings
 
 # SERVICE = get_service()
@@ -29,7 +35,74 @@ def time_and_tz_parse(timezone_str, time_str):
     return time, timezone
 
 
+def aware(time: datetime) -> datetime:
+    """Treats naive times (e.g. all-day events) as UTC, so they can be compared with week bounds."""
+    return time if time.tzinfo is not None else pytz.utc.localize(time)
+
+
+def cached_json_response(cached: CachedResponse):
+    """
+    Serves a cached JSON body with a strong ETag, answering 304 Not Modified if the client already has it.
+    "no-cache" makes the browser revalidate every time, which is cheap since the body is not resent.
+    """
+    response = Response(cached.body, mimetype="application/json")
+    response.set_etag(cached.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def as_current_account(generator):
+    """
+    Runs a streamed response's generator as the account of the request, since it is consumed after the view
+    (and possibly the request's account context) has returned.
+    """
+    account = current_account()
+    def run():
+        with using_account(account):
+            yield from generator
+    return run()
+
+
 def init_routes(app):
+    @app.before_request
+    def select_account():
+        """
+        Serves every request as one account: the only one if there is no accounts file, otherwise the account
+        logged in (with its token, at /login) in this session.
+        """
+        accounts = get_accounts()
+        if not accounts.require_login:
+            account = accounts.default
+        elif request.endpoint in ("login", "static"):
+            return None
+        else:
+            account = accounts.get(session.get("account"))
+            if account is None:
+                return jsonify({"error": "Not logged in; visit /login?token=<account token>"}), 401
+        g.account_tokens = activate_account(account)
+
+    @app.teardown_request
+    def release_account(exception=None):
+        tokens = g.pop("account_tokens", None)
+        if tokens is not None:
+            try:
+                deactivate_account(tokens)
+            except ValueError:
+                pass # torn down in a different context than the request ran in; nothing of it is left to reset
+
+    @app.route("/login")
+    def login():
+        account = get_accounts().by_token(request.args.get("token", ""))
+        if account is None:
+            return jsonify({"error": "Unknown account token"}), 401
+        session["account"] = account.name
+        return redirect("/")
+
+    @app.route("/logout")
+    def logout():
+        session.pop("account", None)
+        return jsonify({"logged_out": True})
+
     @app.route("/")
     def index():
         # Use render_template to serve your HTML file with events data
@@ -37,16 +110,21 @@ def init_routes(app):
 
     @app.route("/api/weekly_events")
     def weekly_events():
-        service = get_service()
         timezone_str = request.args.get("timezone")
         time_str = request.args.get("time")
         time, timezone = time_and_tz_parse(timezone_str, time_str)
+        # get current time, and adjust to start of the week (Monday) and end of the week (Sunday)
+        start, end = week_start_end(time=time, timezone=timezone, isoformat=False)
+
+        # this may run in a background thread when revalidating, so it must not touch `request`
+        def compute():
+            service = get_service()
+            events = get_event_cache().get_events(service, start.isoformat(), end.isoformat())
+            return [event.to_fullcalendar() for event in events]
 
         try:
-            # get current time, and adjust to start of the week (Monday) and end of the week (Sunday)
-            start, end = week_start_end(time=time, timezone=timezone, isoformat=True)
-            events = get_events(service, start, end)
-            return jsonify([event.to_fullcalendar() for event in events])
+            cached = get_response_cache().get(("weekly_events", start.isoformat(), str(timezone)), compute, start, end)
+            return cached_json_response(cached)
         except Exception as e:
             # Log the exception for debugging
             print(f"Error fetching events: {e}")
@@ -54,6 +132,121 @@ def init_routes(app):
             # Return an empty list or appropriate error message in JSON format
             return jsonify({"error": "Failed to fetch events", "details": str(e)}), 500
 
+    @app.route("/api/conflicts")
+    def conflicts():
+        """
+        With `start` and `end`, returns the ids of the events overlapping that range (e.g. where an event is being
+        dragged to), leaving out the event with id `exclude`. Without them, returns every overlapping pair of
+        events in the week around `time`.
+        """
+        ranged = "start" in request.args and "end" in request.args
+        if ranged:
+            try:
+                start, end = (datetime.fromisoformat(request.args[bound]) for bound in ("start", "end"))
+            except ValueError as e:
+                return jsonify({"error": "Invalid conflict range", "details": str(e)}), 400
+        service = get_service()
+        time, timezone = time_and_tz_parse(request.args.get("timezone"), request.args.get("time"))
+        week_start, week_end = week_start_end(time=time, timezone=timezone, isoformat=True)
+        index = get_event_cache().get_index(service, week_start, week_end)
+
+        if ranged:
+            start, end = (t if t.tzinfo is not None else timezone.localize(t) for t in (start, end))
+            exclude = request.args.get("exclude")
+            return jsonify({
+                "conflicts": [event.event_id for _, _, event in index.overlapping(start, end) if event.event_id != exclude]
+            })
+        return jsonify({"conflicts": [[a.event_id, b.event_id] for a, b in index.conflicts()]})
+
+    @app.route("/api/free_slots")
+    def free_slots():
+        """Returns the gaps of at least `duration` minutes (default 30) within working hours in the week around `time`."""
+        try:
+            duration = int(request.args.get("duration", 30))
+        except ValueError:
+            return jsonify({"error": "Invalid duration"}), 400
+        if duration <= 0:
+            return jsonify({"error": "Invalid duration"}), 400
+        service = get_service()
+        time, timezone = time_and_tz_parse(request.args.get("timezone"), request.args.get("time"))
+        min_duration = timedelta(minutes=duration)
+        week_start, week_end = week_start_end(time=time, timezone=timezone, isoformat=False)
+        index = get_event_cache().get_index(service, week_start.isoformat(), week_end.isoformat())
+
+        work_start, work_end = settings.get_working_hours()
+        slots = []
+        for day in range(7):
+            date = (week_start + timedelta(days=day)).date()
+            slots.extend(index.free_slots(
+                timezone.localize(datetime.combine(date, work_start)),
+                timezone.localize(datetime.combine(date, work_end)),
+                min_duration,
+            ))
+        return jsonify([{"start": start.isoformat(), "end": end.isoformat()} for start, end in slots])
+
+    @app.route("/api/export")
+    def export():
+        """
+        Streams events joined with datalink rows between `start` and `end` as NDJSON or CSV.
+        The response has no content length, so it is sent with chunked transfer encoding as it is generated.
+        """
+        service = get_service()
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"Unknown export format: {export_format}"}), 400
+        _, timezone = time_and_tz_parse(request.args.get("timezone"), None)
+        try:
+            start = parse_export_bound(request.args["start"], timezone)
+            end = parse_export_bound(request.args["end"], timezone)
+            chunk_days = int(request.args.get("chunk_days", 7))
+        except (KeyError, ValueError) as e:
+            return jsonify({"error": "Invalid export range", "details": str(e)}), 400
+        if chunk_days < 1:
+            return jsonify({"error": "Invalid export range", "details": "chunk_days must be at least 1"}), 400
+
+        records = export_records(service, start, end, timezone, chunk_days)
+        mimetype = "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+        return Response(stream_with_context(as_current_account(serialize_records(records, export_format))), mimetype=mimetype)
+
+    @app.route("/api/datalink_backfill", methods=["POST"])
+    def datalink_backfill():
+        """
+        Backfills datalink rows for the events between `start` and `end` (see app/backfill.py), streaming
+        progress as NDJSON. Takes a JSON body with start, end, and optionally timezone, rules, datalinks,
+        dry_run, overwrite, all_events and batch_size.
+        """
+        service = get_service()
+        data = request.json or {}
+        _, timezone = time_and_tz_parse(data.get("timezone"), None)
+        try:
+            start = parse_export_bound(data["start"], timezone)
+            end = parse_export_bound(data["end"], timezone)
+            batch_size = int(data.get("batch_size", 500))
+        except (KeyError, ValueError) as e:
+            return jsonify({"error": "Invalid backfill range", "details": str(e)}), 400
+        dry_run = bool(data.get("dry_run", False))
+
+        def generate():
+            try:
+                for record in backfill_records(
+                    service, start, end, timezone,
+                    rules=data.get("rules", []),
+                    datalinks=data.get("datalinks"),
+                    dry_run=dry_run,
+                    overwrite=bool(data.get("overwrite", False)),
+                    all_events=bool(data.get("all_events", False)),
+                    batch_size=batch_size,
+                ):
+                    yield json.dumps(record) + "\n"
+            except Exception as e:
+                print(f"Error backfilling datalinks: {e}")
+                traceback.print_exc()
+                yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+            if not dry_run:
+                get_response_cache().invalidate("weekly_event_datalinks", times=[(start, end)])
+
+        return Response(stream_with_context(as_current_account(generate())), mimetype="application/x-ndjson")
+
     @app.route("/api/calendar_colors")
     def calendar_colors():
         service = get_service()
@@ -62,7 +255,25 @@ def init_routes(app):
     
     @app.route("/api/datalinks")
     def datalinks():
-        return jsonify(parsed_event_datalink_specs())
+        # file-backed option lists can be huge, so they are served piecemeal by /api/datalink_options
+        return jsonify(parsed_event_datalink_specs(expand_indexed=False))
+    
+    @app.route("/api/datalink_options")
+    def datalink_options():
+        datalink_name = request.args.get("datalink")
+        property_name = request.args.get("property")
+        query = request.args.get("q", "")
+        try:
+            limit = int(request.args.get("limit", 20))
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            return jsonify({"error": "Invalid limit", "details": f"limit must be between 1 and {MAX_SEARCH_LIMIT}"}), 400
+        try:
+            index = get_option_index(datalink_name, property_name)
+        except KeyError as e:
+            return jsonify({"error": "Unknown datalink property", "details": str(e)}), 404
+        return jsonify([option.to_json() for option in index.search(query, limit)])
     
     @app.route("/api/weekly_event_datalinks")
     def weekly_event_datalinks():
@@ -70,16 +281,39 @@ def init_routes(app):
         time_str = request.args.get("time")
         time, timezone = time_and_tz_parse(timezone_str, time_str)
         start, end = week_start_end(time=time, timezone=timezone, isoformat=False)
-        datalinks = pull_from_event_datalinks(start=start, end=end)
-        
-        # Convert the EventDatalink objects to JSON-serializable dictionaries
-        serializable_datalinks = {
-            datalink_name: [event_datalink.to_json() for event_datalink in event_datalinks]
-            for datalink_name, event_datalinks in datalinks.items()
-        }
+
+        def compute():
+            datalinks = pull_from_event_datalinks(start=start, end=end)
+            
+            # Convert the EventDatalink objects to JSON-serializable dictionaries
+            return {
+                datalink_name: [event_datalink.to_json() for event_datalink in event_datalinks]
+                for datalink_name, event_datalinks in datalinks.items()
+            }
         
-        return jsonify(serializable_datalinks)
+        cached = get_response_cache().get(("weekly_event_datalinks", start.isoformat(), str(timezone)), compute, start, end)
+        return cached_json_response(cached)
     
+    @app.route("/api/datalink_orphans")
+    def datalink_orphans():
+        """
+        Reports the datalink rows between `start` and `end` (default: the week around `time`) whose event no longer
+        exists in any calendar. Rows come from the event index rather than the logs.
+        """
+        service = get_service()
+        time, timezone = time_and_tz_parse(request.args.get("timezone"), request.args.get("time"))
+        start, end = week_start_end(time=time, timezone=timezone, isoformat=False)
+        try:
+            if "start" in request.args:
+                start = aware(datetime.fromisoformat(request.args["start"]))
+            if "end" in request.args:
+                end = aware(datetime.fromisoformat(request.args["end"]))
+        except ValueError as e:
+            return jsonify({"error": "Invalid range", "details": str(e)}), 400
+
+        event_ids = {event.event_id for event in get_event_cache().get_events(service, start.isoformat(), end.isoformat())}
+        return jsonify(find_orphaned_datalink_rows(start, end, event_ids))
+
     @app.route("/api/event_datalink_push", methods=["POST"])
     def event_datalink_push():
         data = request.json
@@ -100,6 +334,11 @@ def init_routes(app):
             
             # Call push_to_event_datalinks and get the list of failed datalinks
             failed_datalinks = push_to_event_datalinks(event_datalinks)
+            get_response_cache().invalidate(
+                "weekly_event_datalinks",
+                event_ids=[event_datalink.event.id for event_datalink in event_datalinks],
+                times=[(aware(event_datalink.event.start), aware(event_datalink.event.end)) for event_datalink in event_datalinks],
+            )
             
             if not failed_datalinks:
                 return jsonify({"status": 200, "message": "All datalinks pushed successfully"})
@@ -184,4 +423,35 @@ def init_routes(app):
             except Exception as e:
                 print(f"Error modifying event: {e}")
 
+        get_event_cache().invalidate()
+        written_events = data.get("created", []) + data.get("deleted", []) + data.get("modified", [])
+        get_response_cache().invalidate(
+            "weekly_events",
+            event_ids=[event["id"] for event in written_events] + [created["new_id"] for created in response["created"]],
+            times=[
+                (aware(datetime.fromisoformat(event["start"])), aware(datetime.fromisoformat(event["end"])))
+                for event in written_events
+                if event.get("start") and event.get("end")
+            ],
+        )
+
+        # keep the datalink rows of the events that were actually changed in line with them
+        moved = {
+            event["id"]: (datetime.fromisoformat(event["start"]), datetime.fromisoformat(event["end"]))
+            for event in data.get("modified", [])
+            if event["id"] in response["modified"]
+        }
+        remapped = {created["old_id"]: created["new_id"] for created in response["created"]}
+        try:
+            changed_datalinks = cascade_event_changes(moved, response["deleted"], remapped)
+            if changed_datalinks:
+                get_response_cache().invalidate(
+                    "weekly_event_datalinks",
+                    event_ids=list(moved) + response["deleted"] + list(remapped) + list(remapped.values()),
+                    times=[(aware(start), aware(end)) for start, end in moved.values()],
+                )
+        except Exception as e:
+            print(f"Error updating datalinks of changed events: {e}")
+            traceback.print_exc()
+
         return jsonify(response)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+
+class FairScheduler:
+    """
+    Limits the upstream (Google API) calls in flight to `max_concurrent`, and those of any one account to
+    `max_per_account`, so one account making many calls (e.g. a backfill over years of events) cannot take
+    every slot. When a slot frees up it goes to the waiting accounts in round-robin order: an account that
+    just got a slot goes to the back of the line, behind every other account that is waiting.
+    """
+    def __init__(self, max_concurrent=8, max_per_account=4):
+        self.max_concurrent = max_concurrent
+        self.max_per_account = max_per_account
+        self.condition = threading.Condition()
+        self.running: defaultdict[str, int] = defaultdict(int)
+        self.total_running = 0
+        # account -> its waiting callers (first come, first served), with accounts in turn order
+        self.waiting: OrderedDict[str, deque] = OrderedDict()
+
+    def _next_ticket(self):
+        if self.total_running >= self.max_concurrent:
+            return None
+        for account, tickets in self.waiting.items():
+            if self.running.get(account, 0) < self.max_per_account:
+                return tickets[0]
+        return None
+
+    @contextmanager
+    def slot(self, account: str):
+        """Blocks until `account` may make a call, and holds the slot for the duration of the with block."""
+        ticket = object()
+        with self.condition:
+            self.waiting.setdefault(account, deque()).append(ticket)
+            while self._next_ticket() is not ticket:
+                self.condition.wait()
+            self.waiting[account].popleft()
+            if self.waiting[account]:
+                self.waiting.move_to_end(account)
+            else:
+                del self.waiting[account]
+            self.running[account] += 1
+            self.total_running += 1
+            # another slot may still be free for the next in line
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running[account] -= 1
+                if not self.running[account]:
+                    del self.running[account]
+                self.total_running -= 1
+                self.condition.notify_all()
@@ -1,20 +1,31 @@
 import time
+import datetime
 import json
+from contextvars import ContextVar
 from app.structs import EventDatalinkSpec
 
+# the settings of the account being served (see app/accounts.py); when set, every Settings reads through to it
+active_settings: ContextVar["Settings | None"] = ContextVar("active_settings", default=None)
+
 
 class Settings:
-    def __init__(self, settings_path: str):
+    def __init__(self, settings_path: str, overrides: dict | None = None):
         self.settings_path = settings_path
-        with open(self.settings_path) as f:
-            self.settings = json.load(f)
+        self.overrides = overrides or {} # applied over the file on every load, e.g. an account's own datapath
+        self.settings = self._load()
         self.time_last_loaded = time.time()
 
+    def _load(self) -> dict:
+        with open(self.settings_path) as f:
+            return {**json.load(f), **self.overrides}
+
     def get_settings(self):
+        active = active_settings.get()
+        if active is not None and active is not self:
+            return active.get_settings()
         if time.time() - self.time_last_loaded > 10: # cache for 10 seconds
-            with open(self.settings_path) as f:
-                self.settings = json.load(f)
-                self.time_last_loaded = time.time()
+            self.settings = self._load()
+            self.time_last_loaded = time.time()
         return self.settings
     
     def get_calendar_ids(self) -> dict[str, str]:
@@ -26,6 +37,18 @@ class Settings:
     def get_datalink_datapath(self, datalink_name) -> str:
         return f"{self.get_datapath()}/{datalink_name}.csv"
 
+    def get_cache_url(self) -> str:
+        # where caches shared between worker processes live; see app/shared_cache.py
+        return self.get_settings().get("cache_url", "memory://")
+
+    def get_working_hours(self) -> tuple[datetime.time, datetime.time]:
+        # e.g. "working_hours": {"start": "09:00", "end": "17:00"}; defaults to 9 to 5 if not set
+        working_hours = self.get_settings().get("working_hours", {})
+        return (
+            datetime.time.fromisoformat(working_hours.get("start", "09:00")),
+            datetime.time.fromisoformat(working_hours.get("end", "17:00")),
+        )
+
     def get_event_datalinks(self) -> list[EventDatalinkSpec]:
         return [EventDatalinkSpec(**spec) for spec in self.get_settings()["event_datalinks"]]
 
@@ -0,0 +1,366 @@
+"""
+Cache backends shared between worker processes.
+
+Under several gunicorn workers, per-process caches mean every worker fetches the same calendar data from Google
+and keeps its own copy. The backends here hold that data once per host (SQLite in WAL mode) or once per
+deployment (a Redis-protocol server), and InvalidationChannel carries invalidations to every worker.
+
+The backend is chosen with "cache_url" in the settings:
+    "memory://"                  per-process (the default; right for a single worker)
+    "sqlite:///path/to/cache.db" shared by the workers on one host
+    "redis://host:port/db"       shared by everything that can reach the server
+"""
+import json
+import socket
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from app.settings import settings
+
+
+class CacheBackend(ABC):
+    """Byte-valued key-value store with optional expiry (`ttl` in seconds) and atomic counters."""
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        pass
+
+    @abstractmethod
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        """Sets `key` only if it does not exist yet; returns whether it was set (used as a cross-worker lock)."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """Atomically increments the integer at `key` (missing counts as 0) and returns the new value."""
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key: str, value, ttl: float | None = None):
+        self.set(key, json.dumps(value).encode(), ttl)
+
+
+class MemoryBackend(CacheBackend):
+    """
+    A per-process dict. With `max_bytes`, the least recently used entries are evicted once keys and values
+    take up more than that, so the backend can serve as a memory-budgeted cache.
+    """
+    def __init__(self, max_bytes: int | None = None):
+        self.values: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sweep_at = 1024 # expired entries are only dropped when read, so they are swept out once this many pile up
+
+    def _sweep(self):
+        if len(self.values) >= self.sweep_at:
+            now = time.time()
+            for key in [key for key, (_, expires) in self.values.items() if expires is not None and expires < now]:
+                self._remove(key)
+            self.sweep_at = max(1024, 2 * len(self.values))
+
+    def _remove(self, key: str):
+        value, _ = self.values.pop(key)
+        self.size -= len(key) + len(value)
+
+    def _put(self, key: str, value: bytes, expires: float | None):
+        self._sweep()
+        if key in self.values:
+            self._remove(key)
+        self.values[key] = (value, expires)
+        self.size += len(key) + len(value)
+        while self.max_bytes is not None and self.size > self.max_bytes and len(self.values) > 1:
+            self._remove(next(iter(self.values)))
+
+    def _live(self, key: str) -> bytes | None:
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            self._remove(key)
+            return None
+        if value is not None:
+            self.values.move_to_end(key)
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._live(key)
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._put(key, value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        with self.lock:
+            if self._live(key) is not None:
+                return False
+            self._put(key, value, time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.values:
+                self._remove(key)
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self._live(key) or 0) + 1
+            self._put(key, str(value).encode(), None)
+            return value
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    A cache table in a SQLite database in WAL mode, so readers in every worker proceed while one writes.
+    Each thread gets its own connection, since sqlite3 connections cannot be shared between threads.
+    Expired rows are deleted every `sweep_every` writes, so stale payloads and old channel messages do not
+    pile up in the database.
+    """
+    def __init__(self, path: str, sweep_every=500):
+        self.path = path
+        self.local = threading.local()
+        self.sweep_every = sweep_every
+        self.writes = 0
+
+    def _wrote(self):
+        self.writes += 1
+        if self.writes % self.sweep_every == 0:
+            self._connection().execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self.local, "connection", None) is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires >= ?)", (key, time.time())
+        ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None),
+        )
+        self._wrote()
+
+    def add(self, key, value, ttl=None):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, time.time()))
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl if ttl else None),
+            ).rowcount
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._wrote()
+        return inserted == 1
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = int(bytes(row[0])) + 1 if row else 1
+            connection.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, NULL)", (key, str(value).encode()))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return value
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """
+    Speaks the Redis protocol (RESP) directly over a socket, so any Redis-compatible server works without the
+    redis package. Each thread gets its own connection.
+    """
+    def __init__(self, host="localhost", port=6379, db=0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.local = threading.local()
+
+    def _connection(self):
+        if getattr(self.local, "connection", None) is None:
+            sock = socket.create_connection((self.host, self.port), timeout=5)
+            self.local.connection = (sock, sock.makefile("rb"))
+            if self.db:
+                self._command("SELECT", self.db)
+        return self.local.connection
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length == -1 else [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+    def _command(self, *args):
+        sock, reader = self._connection()
+        parts = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+        message = b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+        try:
+            sock.sendall(message)
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            # drop the connection so the next command reconnects
+            self.local.connection = None
+            sock.close()
+            raise
+
+    def get(self, key):
+        return self._command("GET", key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self._command("SET", key, value)
+
+    def add(self, key, value, ttl=None):
+        if ttl:
+            return self._command("SET", key, value, "NX", "PX", int(ttl * 1000)) is not None
+        return self._command("SET", key, value, "NX") is not None
+
+    def delete(self, key):
+        self._command("DEL", key)
+
+    def incr(self, key):
+        return self._command("INCR", key)
+
+
+def backend_from_url(url: str) -> CacheBackend:
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        return SQLiteBackend(parsed.path)
+    if parsed.scheme == "redis":
+        return RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, int(parsed.path.strip("/") or 0))
+    raise ValueError(f"Unknown cache backend: {url}")
+
+
+_SHARED_CACHE: CacheBackend | None = None
+_SHARED_CACHE_LOCK = threading.Lock()
+
+def get_shared_cache() -> CacheBackend:
+    """The process-wide backend configured by "cache_url" in the settings, created on first use."""
+    global _SHARED_CACHE
+    with _SHARED_CACHE_LOCK:
+        if _SHARED_CACHE is None:
+            _SHARED_CACHE = backend_from_url(settings.get_cache_url())
+        return _SHARED_CACHE
+
+
+class InvalidationChannel:
+    """
+    Broadcasts invalidation messages to every process using the same backend, built on nothing but incr and set.
+
+    publish stores each message under a sequence number; poll returns the messages other processes published
+    since the last poll. Messages expire after `retention` seconds; a process that falls so far behind that
+    messages expired before it saw them gets None from poll, and must then drop everything it caches.
+
+    publish takes the sequence number before it writes the message, so a poll can find a number whose
+    message is not there yet. Unless the poll comes more than `retention` after the previous one (when the
+    message may have expired), that message is simply still being written: poll stops before it and picks it
+    up next time. Only a message that stays missing for `write_timeout` seconds (its publisher died between
+    the two steps) makes poll return None.
+    """
+    def __init__(self, name: str, backend: CacheBackend | None = None, retention=3600, write_timeout=10):
+        self.name = name
+        self._backend = backend
+        self.retention = retention
+        self.write_timeout = write_timeout
+        self.seen = None # the last sequence number this process has seen
+        self.polled_at = None # when the messages after `seen` started being published, at the earliest
+        self.missing: tuple[int, float] | None = None # a sequence number whose message was not there yet, and since when
+        self.origin = uuid.uuid4().hex # messages from this channel are not delivered back to it
+        self.lock = threading.Lock()
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_shared_cache()
+
+    def _current(self) -> int:
+        return int(self.backend.get(f"{self.name}:seq") or 0)
+
+    def publish(self, message: dict):
+        seq = self.backend.incr(f"{self.name}:seq")
+        self.backend.set_json(f"{self.name}:msg:{seq}", {"origin": self.origin, "message": message}, self.retention)
+
+    def _caught_up(self, current: int, now: float):
+        self.seen = current
+        self.polled_at = now
+        self.missing = None
+
+    def poll(self) -> list[dict] | None:
+        with self.lock:
+            now = time.time()
+            current = self._current()
+            if self.seen is None:
+                self._caught_up(current, now)
+                return []
+            messages = []
+            for seq in range(self.seen + 1, current + 1):
+                published = self.backend.get_json(f"{self.name}:msg:{seq}")
+                if published is None:
+                    if now - self.polled_at > self.retention:
+                        # it may have expired before this process saw it
+                        self._caught_up(current, now)
+                        return None
+                    if self.missing is None or self.missing[0] != seq:
+                        self.missing = (seq, now)
+                    elif now - self.missing[1] > self.write_timeout:
+                        self._caught_up(current, now)
+                        return None
+                    # not written yet; deliver what came before it and retry from it on the next poll
+                    return messages
+                self.seen = seq
+                if published["origin"] != self.origin:
+                    messages.append(published["message"])
+            self._caught_up(current, now)
+            return messages
@@ -2,7 +2,7 @@ import {dateToWeekID, initializeSelectedTime, timeConvert, weekIDToDate} from ".
 import { IState, IUI, IEventObj, IEventDatalink } from "./types.ts";
 import { NoEventsFound } from "./state.ts";
 import { IModalResult } from "./modal.ts";
-import { fetchEventDatalinks, fetchWeeklyEvents, pushToDatalink, syncEditedEvents } from "./backendService.ts";
+import { fetchDatalinkOptions, fetchEventDatalinks, fetchWeeklyEvents, pushToDatalink, syncEditedEvents } from "./backendService.ts";
 import { syncDatalinks } from "./datalinks.ts";
 
 function eventChangeWrapper(func: (state: IState, ui: IUI, event: IEventObj, ...args: any[]) => void) {
@@ -278,7 +278,11 @@ export function addEventFlow(state: IState, ui: IUI, start: Date, end: Date) {
                 allowFreeText: value.freeform,
                 options: Array.isArray(value.options) 
                     ? value.options.map(option => ({...option, value: `${option.bigText} - ${option.smallText}`}))
-                    : [{bigText: value.options, smallText: "", value: `${value.options} - `}]
+                    : [{bigText: value.options, smallText: "", value: `${value.options} - `}],
+                fetchOptions: value.indexed
+                    ? (query: string) => fetchDatalinkOptions(datalinkSpec.name, key, query)
+                        .then(options => options.map(option => ({...option, value: `${option.bigText} - ${option.smallText}`})))
+                    : undefined
             }));
 
         const modalConfig = {
@@ -499,7 +503,9 @@ export function markEventFlow(state: IState, ui: IUI, event: IEventObj | null) {
             value: key,
             allowFreeText: value.freeform,
             // if value.options is a string s, convert it into {bigText: s, smallText: "", value: "s"}, otherwise use value.options as is
-            options: Array.isArray(value.options) ? value.options : [{bigText: value.options, smallText: "", value: value.options}]
+            options: Array.isArray(value.options) ? value.options : [{bigText: value.options, smallText: "", value: value.options}],
+            // indexed (file-backed) options are too many to ship to the client, so they are queried per keystroke
+            fetchOptions: value.indexed ? (query: string) => fetchDatalinkOptions(datalinkSpec.name, key, query) : undefined
         });
     }
     let modalConfig = {
@@ -1,4 +1,4 @@
-import { IDatalinkSpec, IEventDatalink, IEventObj, IState, IStateEditedEvents, IUI, SyncResult } from "./types";
+import { IDatalinkFieldOption, IDatalinkSpec, IEventDatalink, IEventObj, IState, IStateEditedEvents, IUI, SyncResult } from "./types";
 
 export async function syncEditedEvents(editedEvents: IStateEditedEvents): Promise<SyncResult> {
     const response = await fetch('/api/update_events', {
@@ -24,6 +24,22 @@ export async function fetchWeeklyEvents(timezone: string, time?: Date): Promise<
     }
 }
 
+export async function fetchConflicts(timezone: string, start: Date, end: Date, exclude?: string): Promise<string[]> {
+    // ids of events overlapping [start, end), e.g. the slot an event is being moved into
+    const params = new URLSearchParams({timezone: timezone, time: start.toISOString(), start: start.toISOString(), end: end.toISOString()});
+    if (exclude) {
+        params.set("exclude", exclude);
+    }
+    const response = await fetch(`/api/conflicts?${params.toString()}`);
+    return (await response.json()).conflicts as string[];
+}
+
+export async function fetchFreeSlots(timezone: string, time: Date, durationMinutes: number = 30): Promise<{start: string, end: string}[]> {
+    const params = new URLSearchParams({timezone: timezone, time: time.toISOString(), duration: durationMinutes.toString()});
+    const response = await fetch(`/api/free_slots?${params.toString()}`);
+    return response.json();
+}
+
 export async function fetchColors(): Promise<any> {
     console.log("Fetching calendar colors")
     try {
@@ -40,6 +56,12 @@ export async function fetchDatalinks(): Promise<IDatalinkSpec[]> {
     return response.json() as Promise<IDatalinkSpec[]>;
 }
 
+export async function fetchDatalinkOptions(datalink: string, property: string, query: string, limit: number = 20): Promise<IDatalinkFieldOption[]> {
+    const params = new URLSearchParams({datalink: datalink, property: property, q: query, limit: limit.toString()});
+    const response = await fetch(`/api/datalink_options?${params.toString()}`);
+    return response.json() as Promise<IDatalinkFieldOption[]>;
+}
+
 export async function fetchEventDatalinks(timezone: string, time?: Date): Promise<any> {
     if (time) {
         const response = await fetch(`/api/weekly_event_datalinks?timezone=${encodeURIComponent(timezone)}&time=${encodeURIComponent(time.toISOString())}`);
@@ -67,7 +89,10 @@ declare global {
         syncEditedEvents: typeof syncEditedEvents;
         fetchWeeklyEvents: typeof fetchWeeklyEvents;
         fetchColors: typeof fetchColors;
+        fetchConflicts: typeof fetchConflicts;
+        fetchFreeSlots: typeof fetchFreeSlots;
         fetchDatalinks: typeof fetchDatalinks;
+        fetchDatalinkOptions: typeof fetchDatalinkOptions;
         fetchEventDatalinks: typeof fetchEventDatalinks;
         pushToDatalink: typeof pushToDatalink;
     }
@@ -76,6 +101,9 @@ declare global {
 window.syncEditedEvents = syncEditedEvents;
 window.fetchWeeklyEvents = fetchWeeklyEvents;
 window.fetchColors = fetchColors;
+window.fetchConflicts = fetchConflicts;
+window.fetchFreeSlots = fetchFreeSlots;
 window.fetchDatalinks = fetchDatalinks;
+window.fetchDatalinkOptions = fetchDatalinkOptions;
 window.fetchEventDatalinks = fetchEventDatalinks;
 window.pushToDatalink = pushToDatalink;
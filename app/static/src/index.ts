@@ -6,7 +6,7 @@ import { State } from "./state.ts"
 import { UI } from "./ui.ts"
 import { KeyState } from "./keys.ts"
 import { IEventObj, IState } from "./types.ts";
-import { fetchWeeklyEvents, fetchColors, fetchDatalinks } from "./backendService.ts";
+import { fetchWeeklyEvents, fetchColors, fetchConflicts, fetchDatalinks } from "./backendService.ts";
 import { importEvents, loadForWeek } from './actions.ts';
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -114,6 +114,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (Object.keys(props).length > 0) {
                     state.modifyEvent(updatedEvent.id, props);
                 }
+                if (updatedEvent.start != null && updatedEvent.end != null) {
+                    // other events are checked where the server has them, so unsynced edits to them are not seen
+                    fetchConflicts(ui.userTimezone, updatedEvent.start, updatedEvent.end, updatedEvent.id)
+                        .then(conflicts => ui.showConflicts(conflicts))
+                        .catch(error => console.error('Error fetching conflicts:', error));
+                }
             });
             let keystate = new KeyState(state, ui);
             document.addEventListener('keydown', keystate.handleKeyPress.bind(keystate));
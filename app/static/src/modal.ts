@@ -10,6 +10,8 @@ interface IModalOptionSet {
   value: string;
   allowFreeText?: boolean;
   options: IModalOption[];
+  // if set, options are fetched from this (e.g. the server-side option index) on every keystroke instead of filtered locally
+  fetchOptions?: (query: string) => Promise<IModalOption[]>;
 }
 
 export interface IModalConfig {
@@ -24,6 +26,9 @@ export interface IModalResult {
 
 export let MODAL_OPEN = false;
 
+// fetched options are requested once typing pauses for this long, rather than on every keystroke
+const FETCH_DEBOUNCE_MS = 150;
+
 export class SubModal {
   private container: HTMLDivElement;
   private input: HTMLInputElement;
@@ -31,6 +36,10 @@ export class SubModal {
   private filteredOptions: IModalOption[];
   private selectedIndex: number = -1;
   private optionSet: IModalOptionSet;
+  private latestQuery: string = '';
+  private fetchTimer: number | undefined;
+  private fetchPending: boolean = false;
+  private onFetched: (() => void) | null = null;
 
   constructor(optionSet: IModalOptionSet) {
     this.optionSet = optionSet;
@@ -43,7 +52,7 @@ export class SubModal {
     this.input = document.createElement('input');
     this.input.type = 'text';
     this.input.style.width = '100%';
-    this.input.addEventListener('input', () => this.renderOptions());
+    this.input.addEventListener('input', () => this.updateOptions());
 
     this.optionsList = document.createElement('ul');
     this.optionsList.className = 'modal-options';
@@ -59,7 +68,48 @@ export class SubModal {
     this.container.appendChild(this.optionsList);
 
     this.filteredOptions = [...optionSet.options];
-    this.renderOptions(); // Add this line to show options immediately
+    this.updateOptions(0); // Add this line to show options immediately
+  }
+
+  private updateOptions(delay: number = FETCH_DEBOUNCE_MS) {
+    const fetchOptions = this.optionSet.fetchOptions;
+    if (!fetchOptions) {
+      this.renderOptions();
+      return;
+    }
+    const query = this.input.value;
+    this.latestQuery = query;
+    // the options shown are for an earlier query until the new ones arrive, so none of them stays selected
+    this.fetchPending = true;
+    this.selectedIndex = -1;
+    this.updateSelectedOption();
+    window.clearTimeout(this.fetchTimer);
+    this.fetchTimer = window.setTimeout(() => {
+      fetchOptions(query).then(options => {
+        // responses can arrive out of order; only the one for the latest keystroke is rendered
+        if (query !== this.latestQuery) return;
+        this.renderOptions(options);
+      }).catch(error => console.error('Error fetching options:', error)).then(() => {
+        if (query !== this.latestQuery) return;
+        this.fetchPending = false;
+        const callback = this.onFetched;
+        this.onFetched = null;
+        callback?.();
+      });
+    }, delay);
+  }
+
+  isFetching(): boolean {
+    return this.fetchPending;
+  }
+
+  // runs `callback` once the options for the latest query are shown (replacing any callback already waiting)
+  whenFetched(callback: () => void) {
+    if (this.fetchPending) {
+      this.onFetched = callback;
+    } else {
+      callback();
+    }
   }
 
   private getFilteredOptions(): IModalOption[] {
@@ -69,8 +119,9 @@ export class SubModal {
     );
   }
 
-  renderOptions() {
-    this.filteredOptions = this.getFilteredOptions();
+  renderOptions(options?: IModalOption[]) {
+    // options passed in have already been filtered (by the server)
+    this.filteredOptions = options ?? this.getFilteredOptions();
     this.optionsList.innerHTML = '';
     this.filteredOptions.forEach((option, index) => {
       const li = document.createElement('li');
@@ -189,6 +240,12 @@ export class Modal {
       return;
     }
     const currentSubModal = this.subModals[this.currentSubModalIndex];
+    if (e.key === 'Enter' && currentSubModal.isFetching()) {
+      // Enter picks from the options of what was typed, so it waits for them to arrive
+      e.preventDefault();
+      currentSubModal.whenFetched(() => this.handleKeyDown(e));
+      return;
+    }
     if (currentSubModal.handleKeyDown(e)) {
       if (e.key === 'Enter') {
         this.moveToNextSubModal();
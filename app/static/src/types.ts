@@ -95,11 +95,13 @@ export interface IUI {
     userTimezone: string;
     customCalendarColors: { [key: string]: string };
     eventCustomClasses: Map<string, string[]>;
+    conflictingEventIds: Set<string>;
     timeVisible(time: Date): boolean;
     renderEvent(eventOrId: string | EventApi, skipInterfaceRender?: boolean): void;
     colorEventByCalendar(event: EventApi): void;
     getFullcalendarEventById(id: string): EventApi | null;
     styleEventByDatalinks(eventId: string, event: EventApi): void;
+    showConflicts(eventIds: string[]): void;
     setCalendarColors(calendarColors: { [key: string]: string }): void;
     renderAllEvents(): void;
     showModal(modalConfig: IModalConfig): Promise<IModalResult | undefined>;
@@ -153,6 +155,7 @@ export interface IDatalinkSpec {
 export interface IDatalinkField {
     options: IDatalinkFieldOption[] | string;
     freeform: boolean;
+    indexed?: boolean; // if true, options are empty and must be queried with fetchDatalinkOptions
 }
 
 export type IDatalinkFieldOption = IModalOption;
@@ -14,6 +14,7 @@ export class UI implements IUI {
     userTimezone: string;
     datalinkSpecs: IDatalinkSpec[];
     eventCustomClasses: Map<string, string[]>;
+    conflictingEventIds: Set<string>;
 
     constructor(calendarInterface: ICalendar, state: IState, userTimezone: string) {
         this.interface = calendarInterface;
@@ -22,6 +23,7 @@ export class UI implements IUI {
         this.userTimezone = userTimezone;
         this.datalinkSpecs = [];
         this.eventCustomClasses = new Map();
+        this.conflictingEventIds = new Set();
     }
 
     selectedTimeUpdate(time: Date) {
@@ -98,6 +100,7 @@ export class UI implements IUI {
         this.styleEventByBackgroundLightness(event);
         let customClasses = this.styleEventByDatalinks(id, event);
         customClasses = customClasses.concat(this.styleEventBySyncStatus(id, event));
+        customClasses = customClasses.concat(this.styleEventByConflicts(id));
         this.eventCustomClasses.set(id, customClasses);
         if (!skipInterfaceRender) {
             this.interface.render();
@@ -133,6 +136,22 @@ export class UI implements IUI {
         return [];
     }
 
+    styleEventByConflicts(eventId: string) {
+        return this.conflictingEventIds.has(eventId) ? ['event-conflict'] : [];
+    }
+
+    showConflicts(eventIds: string[]) {
+        // marks the events overlapping the one just moved or resized, unmarking those marked for the previous one
+        const changed = new Set([...this.conflictingEventIds, ...eventIds]);
+        this.conflictingEventIds = new Set(eventIds);
+        changed.forEach(id => {
+            if (this.getFullcalendarEventById(id)) {
+                this.renderEvent(id, true);
+            }
+        });
+        this.interface.render();
+    }
+
     styleEventByDatalinks(eventId: string, event: EventApi) {
         const datalinkExists = Array.from(this.state.datalinks.eventDatalinks.keys()).includes(eventId);
         const datalinkUnsynced = this.state.datalinks.eventsWithNewDatalinks.has(eventId);
@@ -22,6 +22,8 @@ class DatalinkField(SerializableModel):
     options: Union[list[DatalinkFieldOption], str] = Field(default_factory=list)
     freeform: bool = False
     onCreate: bool = False
+    default: Union[str, float, int, bool] = "" # backfilled into log rows written before this property existed
+    indexed: bool = False # options are served by /api/datalink_options rather than shipped in full
 
 class EventDatalinkSpec(SerializableModel):
     name: str
@@ -0,0 +1,164 @@
+import pytest
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+from google.auth.exceptions import RefreshError
+from tenacity import RetryError, stop_after_attempt
+
+from app import accounts as accounts_module
+from app.accounts import current_account, load_accounts, using_account
+from app.integrations import datalink_options, google_calendar
+from app.integrations.datalink import push_to_event_datalink
+from app.integrations.google_calendar import ServicePool
+from app.integrations.event_cache import get_event_cache
+from app.response_cache import get_response_cache
+from app.scheduling import FairScheduler
+from app.settings import settings
+from app.structs import EventDatalink, EventObj
+
+
+def write_accounts(tmp_path, accounts, **config):
+    for account in accounts:
+        settings_path = tmp_path / f"{account['name']}_settings.json"
+        settings_path.write_text(json.dumps({
+            "calendar_ids": {"main": f"{account['name']}@example.com"},
+            "datapath": "/shared/datapath",
+            "event_datalinks": [{"name": "notes", "calendars": ["main"], "properties": {"note": {"freeform": True}}}],
+        }))
+        account.setdefault("settings", str(settings_path))
+        account.setdefault("token", f"{account['name']}-token")
+    path = tmp_path / "ozycal_accounts.json"
+    path.write_text(json.dumps({"secret_key": "secret", "accounts": accounts, **config}))
+    return str(path)
+
+
+@pytest.fixture
+def two_accounts(tmp_path, monkeypatch):
+    for name in ("alice", "bob"):
+        (tmp_path / name).mkdir()
+    accounts = load_accounts(write_accounts(tmp_path, [
+        {"name": "alice", "datapath": str(tmp_path / "alice"), "cache_bytes": 1000},
+        {"name": "bob", "datapath": str(tmp_path / "bob")},
+    ]))
+    monkeypatch.setattr(accounts_module, "_ACCOUNTS", accounts)
+    return accounts
+
+
+def test_fair_scheduler_takes_turns_between_accounts():
+    scheduler = FairScheduler(max_concurrent=1, max_per_account=1)
+    order = []
+
+    def call(account, name):
+        with scheduler.slot(account):
+            order.append(name)
+
+    first = scheduler.slot("heavy")
+    first.__enter__()
+    threads = []
+    for account, name in [("heavy", "heavy 2"), ("heavy", "heavy 3"), ("light", "light 1")]:
+        thread = threading.Thread(target=call, args=(account, name))
+        thread.start()
+        threads.append(thread)
+        # wait until the call is queued, so the queueing order is deterministic
+        while sum(len(tickets) for tickets in scheduler.waiting.values()) < len(threads):
+            time.sleep(0.001)
+    first.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+
+    # the light account's call goes ahead of the heavy account's second queued call
+    assert order == ["heavy 2", "light 1", "heavy 3"]
+    assert scheduler.total_running == 0 and not scheduler.running
+
+
+def test_load_accounts_validates(tmp_path):
+    with pytest.raises(ValueError):
+        load_accounts(write_accounts(tmp_path, [{"name": "alice"}, {"name": "bob"}]))
+
+    path = write_accounts(tmp_path, [{"name": "alice", "datapath": "/a"}])
+    config = json.load(open(path))
+    del config["secret_key"]
+    json.dump(config, open(path, "w"))
+    with pytest.raises(ValueError):
+        load_accounts(path)
+
+    assert not load_accounts(str(tmp_path / "missing.json")).require_login
+
+
+def test_accounts_are_partitioned(two_accounts, tmp_path):
+    alice, bob = two_accounts.get("alice"), two_accounts.get("bob")
+    assert two_accounts.by_token("bob-token") is bob
+    assert two_accounts.by_token("wrong") is None
+    assert current_account() is alice
+
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    event = EventObj(start=start, end=start + timedelta(hours=1), title="Note", id="e1", calendar="main")
+    with using_account(bob):
+        # the module-level settings read through to the account's own settings
+        assert settings.get_datapath() == str(tmp_path / "bob")
+        assert push_to_event_datalink([EventDatalink(datalink_name="notes", event=event, properties={"note": "bob's"})])
+        bob_caches = get_response_cache(), get_event_cache()
+    assert (tmp_path / "bob" / "notes.csv").exists()
+    assert not (tmp_path / "alice" / "notes.csv").exists()
+
+    with using_account(alice):
+        assert settings.get_datapath() == str(tmp_path / "alice")
+        assert get_response_cache() is not bob_caches[0]
+        assert get_response_cache().max_bytes == 1000
+        assert get_event_cache().prefix != bob_caches[1].prefix
+
+
+def test_service_pool_builds_accounts_independently(two_accounts, monkeypatch):
+    alice, bob = two_accounts.get("alice"), two_accounts.get("bob")
+    pool = ServicePool()
+    building_alice = threading.Event()
+    release_alice = threading.Event()
+
+    def build(account):
+        if account is alice:
+            building_alice.set()
+            release_alice.wait(5)
+        return object()
+    monkeypatch.setattr(pool, "_build", build)
+
+    thread = threading.Thread(target=pool.get, args=(alice,))
+    thread.start()
+    building_alice.wait(5)
+    # alice's slow build (e.g. an interactive login) does not hold up bob
+    bob_service = pool.get(bob)
+    assert pool.get(bob) is bob_service
+    release_alice.set()
+    thread.join()
+    assert pool.get(alice) is not bob_service
+
+
+def test_refresh_error_discards_service(two_accounts, monkeypatch):
+    pool = ServicePool()
+    monkeypatch.setattr(pool, "_build", lambda account: object())
+    monkeypatch.setattr(google_calendar, "service_pool", pool)
+    service = pool.get(current_account())
+
+    def revoked():
+        raise RefreshError("invalid_grant")
+    with pytest.raises(RetryError):
+        google_calendar.make_api_call.retry_with(stop=stop_after_attempt(1))(revoked)
+    assert pool.get(current_account()) is not service
+
+
+def test_option_indexes_are_capped_per_account(two_accounts, monkeypatch):
+    monkeypatch.setattr(datalink_options, "MAX_OPTION_INDEXES", 1)
+    with using_account(two_accounts.get("bob")):
+        datalink_options.get_option_index("notes", "note")
+        assert len(datalink_options._OPTION_INDEXES["bob"]) == 1
+    with using_account(two_accounts.get("alice")):
+        datalink_options.get_option_index("notes", "note")
+    # alice's index neither evicted bob's nor was mixed up with it
+    assert list(datalink_options._OPTION_INDEXES["bob"])[0][0].startswith(str(two_accounts.get("bob").settings.settings["datapath"]))
+    assert len(datalink_options._OPTION_INDEXES["alice"]) == 1
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
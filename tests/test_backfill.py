@@ -0,0 +1,134 @@
+import pytest
+import csv
+from datetime import datetime, timedelta
+import pytz
+
+from app.backfill import DatalinkMatcher, OptionMatcher, backfill_records, title_words
+from app.integrations.datalink import DatalinkLog
+from app.settings import settings
+from app.structs import DatalinkField, DatalinkFieldOption, EventDatalinkSpec
+from tests.test_export import FakeService, gcal_event
+
+
+def option(text, value=None, small=""):
+    return DatalinkFieldOption(bigText=text, smallText=small, value=text if value is None else value)
+
+
+@pytest.fixture
+def datapath(tmp_path, monkeypatch):
+    (tmp_path / "sports.csv").write_text("Running,outdoors\nSwimming,pool\nTrail running,hills\n")
+    monkeypatch.setattr(settings, "settings", {
+        "datapath": str(tmp_path),
+        "calendar_ids": {"health": "cal_health", "work": "cal_work"},
+        "event_datalinks": [{
+            "name": "workouts",
+            "calendars": ["health"],
+            "properties": {
+                "sport": {"options": "{{datapath}}/sports.csv"},
+                "effort": {"options": [{"bigText": "1", "smallText": "easy", "value": 1}, {"bigText": "2", "smallText": "hard", "value": 2}], "default": 1},
+            },
+        }],
+    })
+    monkeypatch.setattr(settings, "time_last_loaded", float("inf"))
+    return tmp_path
+
+
+def titled(event_id, title, start):
+    event = gcal_event(event_id, start)
+    event["summary"] = title
+    return event
+
+
+def test_option_matcher_prefers_longest_text():
+    matcher = OptionMatcher(DatalinkField(options=[option("Running"), option("Trail running"), option("3")]))
+    assert matcher.match(title_words("Morning trail running")) == "Trail running"
+    assert matcher.match(title_words("running late")) == "Running"
+    # texts without letters are never matched
+    assert matcher.match(title_words("3 laps")) is None
+
+
+def test_datalink_matcher_rules_and_validation():
+    spec = EventDatalinkSpec(name="workouts", calendars=["health"], properties={
+        "sport": DatalinkField(options=[option("Running"), option("Swimming")]),
+        "note": DatalinkField(freeform=True),
+    })
+    matcher = DatalinkMatcher(spec, [{"datalink": "workouts", "property": "sport", "pattern": r"\bjog", "value": "Running"}])
+    assert matcher.properties("Jogging with Sam") == {"sport": "Running", "note": ""}
+    assert matcher.properties("Dentist") is None
+    assert matcher.validate({"sport": "Cycling", "note": ""}) is not None
+    assert matcher.validate({"sport": "Swimming", "note": ""}) is None
+
+
+def test_backfill_writes_each_log_once(datapath, monkeypatch):
+    t = datetime(2024, 1, 1, 8, tzinfo=pytz.utc)
+    service = FakeService({
+        "cal_health": [
+            [titled("h1", "Running (hard)", t), titled("h2", "Swimming", t + timedelta(days=1))],
+            [titled("h3", "Dentist", t + timedelta(days=2)), titled("h4", "Trail running", t + timedelta(days=3))],
+        ],
+        "cal_work": [[titled("w1", "Running the standup", t)]],
+    })
+    writes = []
+    add_rows = DatalinkLog.add_rows
+    def counting_add_rows(self, rows):
+        writes.append(len(rows))
+        return add_rows(self, rows)
+    monkeypatch.setattr(DatalinkLog, "add_rows", counting_add_rows)
+
+    records = list(backfill_records(service, t, t + timedelta(days=7), batch_size=2, dry_run=True))
+    assert [record["type"] for record in records] == ["progress", "progress", "progress", "summary"]
+    assert records[-1]["datalinks"]["workouts"] == {"matched": 3, "existing": 0, "invalid": 0}
+    assert [row["event"]["id"] for row in records[-1]["sample"]["workouts"]] == ["h1", "h2", "h4"]
+    assert writes == []
+
+    records = list(backfill_records(service, t, t + timedelta(days=7), batch_size=2))
+    assert records[-2] == {"type": "committed", "datalink": "workouts", "rows": 3}
+    assert writes == [3]
+    with open(datapath / "workouts.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["event_id"], row["sport"], row["effort"]) for row in rows] == [
+        ("h1", "Running", "2"), ("h2", "Swimming", "1"), ("h4", "Trail running", "1"),
+    ]
+
+    # events that already have rows are left alone
+    records = list(backfill_records(service, t, t + timedelta(days=7)))
+    assert records[-1]["datalinks"]["workouts"]["existing"] == 3
+    assert writes == [3]
+
+
+def test_backfill_with_settings_shaped_spec(tmp_path, monkeypatch):
+    # like "wlog" in ozycal_settings.json: file-backed task and type, inline focus and social without defaults
+    (tmp_path / "wtasks.csv").write_text("Quarterly report,finance\nCode review,eng\n")
+    (tmp_path / "wtypes.csv").write_text("Deep work,\nAdmin,\n")
+    monkeypatch.setattr(settings, "settings", {
+        "datapath": str(tmp_path),
+        "calendar_ids": {"work": "cal_work"},
+        "event_datalinks": [{
+            "name": "wlog",
+            "eventTitleSourceProperty": "task",
+            "calendars": ["work"],
+            "properties": {
+                "task": {"options": "{{datapath}}/wtasks.csv", "freeform": False},
+                "type": {"options": "{{datapath}}/wtypes.csv", "freeform": False},
+                "focus": {"options": [{"bigText": "1", "smallText": "high focus", "value": 1}, {"bigText": "2", "smallText": "normal focus", "value": 2}], "freeform": False},
+                "social": {"options": [{"bigText": "solo", "smallText": "", "value": "solo"}, {"bigText": "group", "smallText": "", "value": "group"}], "freeform": False},
+                "notes": {"freeform": True},
+            },
+        }],
+    })
+    monkeypatch.setattr(settings, "time_last_loaded", float("inf"))
+    t = datetime(2024, 1, 1, 8, tzinfo=pytz.utc)
+    service = FakeService({"cal_work": [[titled("w1", "Quarterly report", t), titled("w2", "Code review (group)", t + timedelta(hours=2))]]})
+
+    records = list(backfill_records(service, t, t + timedelta(days=1)))
+    assert records[-1]["datalinks"]["wlog"] == {"matched": 2, "existing": 0, "invalid": 0}
+    with open(tmp_path / "wlog.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["task"], row["type"], row["focus"], row["social"]) for row in rows] == [
+        ("Quarterly report", "", "", ""), ("Code review", "", "", "group"),
+    ]
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
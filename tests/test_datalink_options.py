@@ -0,0 +1,49 @@
+import pytest
+from app.integrations.datalink_options import OptionIndex, subsequence_gaps
+from app.structs import DatalinkFieldOption
+
+
+def make_options(*labels):
+    return [DatalinkFieldOption(bigText=big, smallText=small, value=big) for big, small in labels]
+
+
+def test_prefix_and_word_prefix_matches():
+    index = OptionIndex(make_options(
+        ("team meeting", "weekly"),
+        ("meeting notes", ""),
+        ("reading", "papers"),
+    ))
+
+    results = [option.bigText for option in index.search("meet")]
+
+    # whole-label prefix matches come before matches on a later word
+    assert results == ["meeting notes", "team meeting"]
+
+
+def test_usage_ranks_matches():
+    options = make_options(("write paper", ""), ("write code", ""), ("write email", ""))
+    index = OptionIndex(options, usage={"write email": 3.0, "write code": 1.0})
+
+    assert [option.bigText for option in index.search("wri")] == ["write email", "write code", "write paper"]
+    assert [option.bigText for option in index.search("", limit=1)] == ["write email"]
+
+
+def test_fuzzy_matches_fill_remaining_slots():
+    index = OptionIndex(make_options(("ozycal development", ""), ("other", ""), ("cal", "")))
+
+    results = [option.bigText for option in index.search("ozdev")]
+    assert results == ["ozycal development"]
+
+    results = [option.bigText for option in index.search("cal", limit=2)]
+    assert results == ["cal", "ozycal development"]
+
+
+def test_subsequence_gaps():
+    assert subsequence_gaps("abc", "abc") == 0
+    assert subsequence_gaps("ac", "abc") == 1
+    assert subsequence_gaps("ca", "abc") is None
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
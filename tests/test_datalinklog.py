@@ -1,8 +1,9 @@
 import pytest
 from datetime import datetime, timedelta
-from app.integrations.datalink import DatalinkLog, COLUMN_SPEC
+from app.integrations.datalink import DatalinkLog, COLUMN_SPEC, log_lock
 from app.structs import EventDatalinkSpec, DatalinkField, EventObj, EventDatalink
 import csv
+import fcntl
 import tempfile
 import os
 
@@ -157,6 +158,150 @@ def test_edit_rows():
         # Clean up the temporary file
         os.unlink(temp_path)
 
+def test_schema_evolution():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = os.path.join(temp_dir, "test_datalink.csv")
+        old_spec = EventDatalinkSpec(
+            name="test_datalink",
+            calendars=["test_calendar"],
+            properties={
+                "prop1": DatalinkField(freeform=True),
+                "prop2": DatalinkField(freeform=True)
+            }
+        )
+        # prop2 is removed and prop3 added after some rows were already logged
+        new_spec = EventDatalinkSpec(
+            name="test_datalink",
+            calendars=["test_calendar"],
+            properties={
+                "prop3": DatalinkField(freeform=True, default="unknown"),
+                "prop1": DatalinkField(freeform=True)
+            }
+        )
+
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMN_SPEC + list(old_spec.properties.keys()))
+
+        now = datetime.now()
+        def make_row(event_id, properties):
+            event = EventObj(start=now, end=now + timedelta(hours=1), title="Test Event", id=event_id, calendar="test_calendar")
+            return EventDatalink(datalink_name="test_datalink", event=event, properties=properties)
+
+        old_log = DatalinkLog(old_spec)
+        old_log.path = temp_path
+        old_log.add_rows([make_row("event1", {"prop1": "a", "prop2": "b"}), make_row("event2", {"prop1": "c", "prop2": "d"})])
+
+        new_log = DatalinkLog(new_spec)
+        new_log.path = temp_path
+        new_log.add_rows([make_row("event3", {"prop1": "e", "prop3": "f"})])
+
+        # the old file was set aside as a segment rather than rewritten
+        assert new_log.segment_paths() == [os.path.join(temp_dir, "test_datalink.v1.csv")]
+        rows = {row["event_id"]: row for row in new_log.get_rows()}
+        assert rows["event1"]["prop1"] == "a" and rows["event1"]["prop3"] == "unknown"
+        assert rows["event3"]["prop1"] == "e" and rows["event3"]["prop3"] == "f"
+        assert rows["event3"]["id"] == "3"
+
+        # updating a row that lives in an old segment moves it to the current file
+        new_log.add_rows([make_row("event2", {"prop1": "g", "prop3": "h"})])
+        assert len(new_log.get_rows()) == 3
+        assert {row["event_id"]: row["prop3"] for row in new_log.get_rows()}["event2"] == "h"
+
+        assert new_log.migrate_segment()
+        assert new_log.segment_paths() == []
+        assert not new_log.migrate_segment()
+        with open(temp_path, 'r') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            migrated = {row[4]: dict(zip(header, row)) for row in reader}
+        # the removed prop2 column is kept, so no logged data is lost
+        assert header == COLUMN_SPEC + ["prop3", "prop1", "prop2"]
+        assert migrated["event1"]["prop2"] == "b" and migrated["event1"]["prop3"] == "unknown"
+        assert sorted(migrated) == ["event1", "event2", "event3"]
+        # event2 was updated out of its segment after prop2 was removed, and kept its prop2 value
+        assert migrated["event2"]["prop2"] == "d"
+
+def test_update_keeps_removed_columns():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = os.path.join(temp_dir, "test_datalink.csv")
+        with open(temp_path, 'w', newline='') as f:
+            csv.writer(f).writerow(COLUMN_SPEC + ["a", "b"])
+
+        now = datetime.now()
+        event = EventObj(start=now, end=now + timedelta(hours=1), title="Test Event", id="event1", calendar="test_calendar")
+        old_log = DatalinkLog(EventDatalinkSpec(
+            name="test_datalink", calendars=["test_calendar"],
+            properties={"a": DatalinkField(freeform=True), "b": DatalinkField(freeform=True)},
+        ))
+        old_log.path = temp_path
+        old_log.add_rows([EventDatalink(datalink_name="test_datalink", event=event, properties={"a": "x", "b": "keepme"})])
+
+        # b is dropped from the spec, then the event's row is updated
+        new_log = DatalinkLog(EventDatalinkSpec(
+            name="test_datalink", calendars=["test_calendar"], properties={"a": DatalinkField(freeform=True)},
+        ))
+        new_log.path = temp_path
+        new_log.add_rows([EventDatalink(datalink_name="test_datalink", event=event, properties={"a": "y"})])
+
+        with open(temp_path, 'r') as f:
+            rows = list(csv.DictReader(f))
+        assert [(row["a"], row["b"]) for row in rows] == [("y", "keepme")]
+
+def test_reads_see_the_log_as_it_was_when_they_started():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = os.path.join(temp_dir, "test_datalink.csv")
+        def make_log(*properties):
+            log = DatalinkLog(EventDatalinkSpec(
+                name="test_datalink", calendars=["test_calendar"],
+                properties={name: DatalinkField(freeform=True) for name in properties},
+            ))
+            log.path = temp_path
+            return log
+        with open(temp_path, 'w', newline='') as f:
+            csv.writer(f).writerow(COLUMN_SPEC + ["a"])
+
+        now = datetime.now()
+        def make_row(event_id, properties):
+            event = EventObj(start=now, end=now + timedelta(hours=1), title="Test Event", id=event_id, calendar="test_calendar")
+            return EventDatalink(datalink_name="test_datalink", event=event, properties=properties)
+
+        make_log("a").add_rows([make_row("event1", {"a": "x"})])
+        make_log("a", "b").add_rows([make_row("event2", {"a": "y", "b": "z"})])
+
+        rows = make_log("a", "b").iter_rows()
+        assert next(rows)["event_id"] == "event1"
+        # a new segment is started, and a row of the old segment is deleted, while the read is under way
+        make_log("a", "b", "c").add_rows([make_row("event3", {"a": "w", "b": "v", "c": "u"})])
+        make_log("a", "b", "c").apply_event_changes({"event2": None})
+        assert [row["event_id"] for row in rows] == ["event2"]
+        assert [row["event_id"] for row in make_log("a", "b", "c").iter_rows()] == ["event1", "event3"]
+
+        # migrating a segment does not change the files an earlier read has open either
+        rows = make_log("a", "b", "c").iter_rows()
+        assert next(rows)["event_id"] == "event1"
+        assert make_log("a", "b", "c").migrate_segment()
+        assert [row["event_id"] for row in rows] == ["event3"]
+
+def test_log_lock_excludes_other_processes():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        lock = log_lock(os.path.join(temp_dir, "test_datalink.csv"))
+        # another process opens the lock file separately; flock conflicts between separate opens even in one process
+        def locked_elsewhere():
+            with open(os.path.join(temp_dir, "test_datalink.lock"), "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                fcntl.flock(f, fcntl.LOCK_UN)
+                return False
+
+        with lock:
+            with lock: # reentrant
+                assert locked_elsewhere()
+            assert locked_elsewhere()
+        assert not locked_elsewhere()
+
 # Run the tests
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
@@ -0,0 +1,131 @@
+import pytest
+import csv
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+
+from app.settings import settings
+from app.integrations.datalink import DatalinkLog, cascade_event_changes, find_orphaned_datalink_rows, push_to_event_datalink
+from app.integrations.event_index import EventIndex, get_event_index
+from app.structs import EventDatalink, EventObj
+
+
+@pytest.fixture
+def datapath(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "settings", {
+        "datapath": str(tmp_path),
+        "event_datalinks": [
+            {"name": "workouts", "calendars": ["health"], "properties": {"kind": {"freeform": True}}},
+            {"name": "meals", "calendars": ["health"], "properties": {"food": {"freeform": True}}},
+        ],
+    })
+    monkeypatch.setattr(settings, "time_last_loaded", float("inf"))
+    return tmp_path
+
+
+def datalink_row(datalink_name: str, event_id: str, start: datetime, **properties) -> EventDatalink:
+    event = EventObj(start=start, end=start + timedelta(hours=1), title="Event", id=event_id, calendar="health")
+    return EventDatalink(datalink_name=datalink_name, event=event, properties=properties)
+
+
+def read_csv(path) -> list[dict]:
+    with open(path) as f:
+        return list(csv.DictReader(f))
+
+
+def workouts_log() -> DatalinkLog:
+    return DatalinkLog(next(spec for spec in settings.get_event_datalinks() if spec.name == "workouts"))
+
+
+def test_cascade_event_changes(datapath):
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    push_to_event_datalink([datalink_row("workouts", "e1", start, kind="run"), datalink_row("workouts", "e2", start, kind="swim")])
+    push_to_event_datalink([datalink_row("meals", "e3", start, food="soup")])
+    assert get_event_index().lookup("e1") == [("workouts", "1")]
+
+    moved_start = start + timedelta(days=1)
+    changed = cascade_event_changes({"e1": (moved_start, moved_start + timedelta(hours=2))}, ["e2"], {"e3": "e3-created"})
+    assert changed == {"workouts": 2, "meals": 1}
+
+    workouts = read_csv(datapath / "workouts.csv")
+    assert [(row["event_id"], row["start"], row["kind"]) for row in workouts] == [("e1", moved_start.isoformat(), "run")]
+    assert [row["event_id"] for row in read_csv(datapath / "meals.csv")] == ["e3-created"]
+
+    assert get_event_index().lookup("e2") == []
+    assert get_event_index().lookup("e3") == []
+    assert get_event_index().lookup("e3-created") == [("meals", "1")]
+
+    # events without datalink rows are ignored
+    assert cascade_event_changes({"unknown": (start, start)}, ["also-unknown"], {}) == {}
+
+
+def test_cascade_rewrites_only_the_files_holding_the_rows(datapath, monkeypatch):
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    push_to_event_datalink([datalink_row("workouts", "e1", start, kind="run")])
+    # a new property starts a segment, so e1's row is now in workouts.v1.csv
+    settings.settings["event_datalinks"][0]["properties"]["effort"] = {"freeform": True}
+    push_to_event_datalink([datalink_row("workouts", "e2", start, kind="swim", effort="easy")])
+    assert get_event_index().files_of(workouts_log(), ["e1", "e2"]) == {"e1": "workouts.v1.csv", "e2": "workouts.csv"}
+
+    rewritten = []
+    apply_changes_to_file = DatalinkLog._apply_changes_to_file
+    def recording_apply_changes_to_file(self, path, changes):
+        rewritten.append(os.path.basename(path))
+        return apply_changes_to_file(self, path, changes)
+    monkeypatch.setattr(DatalinkLog, "_apply_changes_to_file", recording_apply_changes_to_file)
+
+    assert cascade_event_changes({}, [], {"e2": "e2-created"}) == {"workouts": 1}
+    assert rewritten == ["workouts.csv"]
+    rewritten.clear()
+    assert cascade_event_changes({}, ["e1"], {}) == {"workouts": 1}
+    assert rewritten == ["workouts.v1.csv"]
+    assert [row["event_id"] for row in read_csv(datapath / "workouts.v1.csv")] == []
+    assert [row["event_id"] for row in read_csv(datapath / "workouts.csv")] == ["e2-created"]
+
+
+def test_index_rebuilds_after_outside_edit(datapath):
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    push_to_event_datalink([datalink_row("workouts", "e1", start, kind="run")])
+    with open(datapath / "workouts.csv", "a", newline="") as f:
+        csv.writer(f).writerow(["2", start.isoformat(), (start + timedelta(hours=1)).isoformat(), "health", "e2", "bike"])
+
+    cascade_event_changes({}, ["e2"], {})
+    assert [row["event_id"] for row in read_csv(datapath / "workouts.csv")] == ["e1"]
+
+
+def test_find_orphaned_datalink_rows(datapath):
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    push_to_event_datalink([datalink_row("workouts", "e1", start, kind="run"), datalink_row("workouts", "e2", start, kind="swim")])
+    push_to_event_datalink([datalink_row("workouts", "e3", start + timedelta(days=10), kind="row")])
+
+    orphans = find_orphaned_datalink_rows(start - timedelta(days=1), start + timedelta(days=6), {"e1"})
+    assert [(orphan["datalink_name"], orphan["event_id"]) for orphan in orphans] == [("workouts", "e2")]
+
+
+def test_no_write_lands_between_a_push_and_its_index_update(datapath, monkeypatch):
+    start = datetime(2024, 1, 1, 9, tzinfo=pytz.utc)
+    push_to_event_datalink([datalink_row("workouts", "e1", start, kind="run")])
+    workouts = workouts_log()
+    # e.g. another worker writing without telling this index
+    other_write = threading.Thread(target=workouts.add_rows, args=([datalink_row("workouts", "e2", start, kind="swim")],))
+
+    record_rows = EventIndex.record_rows
+    def record_rows_slowly(self, datalink_log, rows):
+        if not other_write.is_alive() and other_write.ident is None:
+            other_write.start()
+            time.sleep(0.2)
+        return record_rows(self, datalink_log, rows)
+    monkeypatch.setattr(EventIndex, "record_rows", record_rows_slowly)
+
+    push_to_event_datalink([datalink_row("workouts", "e3", start, kind="bike")])
+    other_write.join()
+    # the other write had to wait for the push to be indexed, so the index sees it as a change to catch up on
+    get_event_index().sync([workouts])
+    assert get_event_index().lookup("e2") == [("workouts", "3")]
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,178 @@
+import pytest
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytz
+
+from app.export import date_chunks, export_records, main, to_csv, to_ndjson
+from app.integrations import google_calendar
+from app.integrations.datalink import DatalinkLog, push_to_event_datalink
+from app.integrations.google_calendar import iter_events
+from app.settings import settings
+from app.structs import EventDatalink, EventObj
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        for request, request_id in self.requests:
+            self.callback(request_id, request.execute(), None)
+
+
+class FakeEvents:
+    """
+    Serves `pages[calendar_id]` one page per events().list call (keeping only the events overlapping timeMin to
+    timeMax), recording every call made as (calendar id, page token, timeMin).
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def list(self, calendarId, pageToken=None, timeMin=None, timeMax=None, **kwargs):
+        self.calls.append((calendarId, pageToken, timeMin))
+        page = int(pageToken or 0)
+        items = [
+            item for item in self.pages[calendarId][page]
+            if timeMin is None or datetime.fromisoformat(item["end"]["dateTime"]) > datetime.fromisoformat(timeMin)
+            if timeMax is None or datetime.fromisoformat(item["start"]["dateTime"]) < datetime.fromisoformat(timeMax)
+        ]
+        response = {"items": items}
+        if page + 1 < len(self.pages[calendarId]):
+            response["nextPageToken"] = str(page + 1)
+        return FakeRequest(response)
+
+
+class FakeService:
+    def __init__(self, pages):
+        self._events = FakeEvents(pages)
+
+    def events(self):
+        return self._events
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+
+def gcal_event(event_id, start, hours=1):
+    return {
+        "id": event_id,
+        "summary": event_id,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + timedelta(hours=hours)).isoformat()},
+    }
+
+
+def test_date_chunks_cover_range():
+    start = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    end = datetime(2024, 1, 20, tzinfo=pytz.utc)
+    chunks = list(date_chunks(start, end, 7))
+    assert chunks[0][0] == start
+    assert chunks[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert len(chunks) == 3
+
+
+def test_iter_events_lists_windows_lazily_and_merges(monkeypatch):
+    monkeypatch.setattr(google_calendar.settings, "get_calendar_ids", lambda: {"a": "cal_a", "b": "cal_b"})
+    t = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    later = t + timedelta(days=40)
+    service = FakeService({
+        "cal_a": [[gcal_event("a2", t + timedelta(hours=3)), gcal_event("a1", t)], [gcal_event("a3", later)]],
+        # b1 spans the first two windows, and is only yielded once
+        "cal_b": [[gcal_event("b1", t + timedelta(days=27), hours=48)]],
+    })
+
+    events = iter_events(service, t.isoformat(), (t + timedelta(days=60)).isoformat())
+    first = next(events)
+    assert first.event_id == "a1"
+    # the second window has not been listed yet
+    second_window = (t + timedelta(days=28)).isoformat()
+    assert not any(timeMin == second_window for _, _, timeMin in service.events().calls)
+
+    rest = [event.event_id for event in events]
+    assert rest == ["a2", "b1", "a3"]
+    assert first.calendar == "a"
+
+
+def test_serializers():
+    records = [
+        {"type": "event", "calendar": "work", "event_id": "e1", "start": "s", "end": "e", "summary": "x", "is_all_day": False, "datalinks": {"wlog": {"task": "t"}}},
+        {"type": "datalink", "calendar": "work", "event_id": "e2", "start": "s", "end": "e", "datalink_name": "wlog", "properties": {"task": "u"}},
+    ]
+
+    lines = list(to_ndjson(iter(records)))
+    assert [json.loads(line) for line in lines] == records
+
+    rows = list(csv.DictReader(io.StringIO("".join(to_csv(iter(records))))))
+    assert rows[0]["event_id"] == "e1"
+    assert json.loads(rows[0]["properties"]) == {"wlog": {"task": "t"}}
+    assert rows[1]["datalink_name"] == "wlog"
+    assert json.loads(rows[1]["properties"]) == {"task": "u"}
+
+
+def test_export_streams_rows_per_chunk_and_keeps_rows_of_events_under_way(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "settings", {
+        "datapath": str(tmp_path),
+        "calendar_ids": {"work": "cal_work"},
+        "event_datalinks": [{"name": "notes", "calendars": ["work"], "properties": {"note": {"freeform": True}}}],
+    })
+    monkeypatch.setattr(settings, "time_last_loaded", float("inf"))
+    t = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    events = [
+        gcal_event("overnight", t - timedelta(hours=4), hours=10),
+        gcal_event("e1", t + timedelta(days=1)),
+        gcal_event("e2", t + timedelta(days=8)),
+    ]
+    rows = [(event, f"note on {event['id']}") for event in events] + [(gcal_event("gone", t + timedelta(days=9)), "orphan")]
+    assert push_to_event_datalink([
+        EventDatalink(datalink_name="notes", properties={"note": note}, event=EventObj(
+            id=event["id"], title=event["summary"], calendar="work",
+            start=datetime.fromisoformat(event["start"]["dateTime"]), end=datetime.fromisoformat(event["end"]["dateTime"]),
+        ))
+        for event, note in rows
+    ])
+
+    reads = []
+    iter_rows = DatalinkLog.iter_rows
+    def counting_iter_rows(self, *args):
+        reads.append(self.spec.name)
+        return iter_rows(self, *args)
+    monkeypatch.setattr(DatalinkLog, "iter_rows", counting_iter_rows)
+
+    records = export_records(FakeService({"cal_work": [events]}), t, t + timedelta(days=14))
+    first = next(records)
+    # only the first chunk's rows have been read so far
+    assert reads == ["notes"]
+    records = [first, *records]
+    assert reads == ["notes", "notes"]
+    assert [(record["type"], record["event_id"]) for record in records] == [
+        ("event", "overnight"), ("event", "e1"), ("event", "e2"), ("datalink", "gone"),
+    ]
+    # the overnight event started before the export range, but its row is still joined to it
+    assert records[0]["datalinks"] == {"notes": {"note": "note on overnight"}}
+    assert records[2]["datalinks"] == {"notes": {"note": "note on e2"}}
+
+
+def test_chunk_days_must_be_positive():
+    with pytest.raises(SystemExit):
+        main(["--start", "2024-01-01", "--end", "2024-02-01", "--chunk-days", "0"])
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,56 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+from app.intervals import IntervalIndex
+
+T0 = datetime(2024, 1, 1, 9)
+
+
+def at(hours):
+    return T0 + timedelta(hours=hours)
+
+
+def test_overlapping_matches_brute_force():
+    rng = random.Random(0)
+    intervals = []
+    for i in range(200):
+        start = rng.uniform(0, 100)
+        intervals.append((at(start), at(start + rng.uniform(0, 5)), i))
+    index = IntervalIndex(intervals)
+
+    for _ in range(100):
+        query_start = rng.uniform(-5, 105)
+        query_end = query_start + rng.uniform(0, 10)
+        expected = {i for start, end, i in intervals if start < at(query_end) and end > at(query_start)}
+        assert {i for _, _, i in index.overlapping(at(query_start), at(query_end))} == expected
+
+
+def test_conflicts():
+    index = IntervalIndex([
+        (at(0), at(2), "a"),
+        (at(1), at(3), "b"),
+        (at(3), at(4), "c"), # touches b but does not overlap it
+        (at(3.5), at(5), "d"),
+    ])
+    assert index.conflicts() == [("a", "b"), ("c", "d")]
+
+
+def test_free_slots():
+    index = IntervalIndex([
+        (at(0), at(1), "a"),
+        (at(0.5), at(1.5), "b"),
+        (at(2), at(3), "c"),
+        (at(7), at(8), "d"),
+    ])
+    slots = index.free_slots(at(0), at(8), timedelta(hours=1))
+    assert slots == [(at(3), at(7))]
+
+    slots = index.free_slots(at(0), at(8), timedelta(minutes=30))
+    assert slots == [(at(1.5), at(2)), (at(3), at(7))]
+
+    assert IntervalIndex([]).free_slots(at(0), at(8), timedelta(hours=1)) == [(at(0), at(8))]
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,158 @@
+import pytest
+from datetime import datetime
+import pytz
+from app.integrations import google_calendar
+from app.integrations.series_cache import SeriesCache
+from app.recurrence import expand_gcal_events, expand_series
+from app.shared_cache import MemoryBackend
+from tests.test_export import FakeBatch
+
+LONDON = pytz.timezone("Europe/London")
+
+
+def standup(recurrence, **kwargs):
+    event = {
+        "id": "standup",
+        "summary": "Standup",
+        "updated": "2024-01-01T00:00:00Z",
+        "start": {"dateTime": "2024-03-18T09:00:00+00:00", "timeZone": "Europe/London"},
+        "end": {"dateTime": "2024-03-18T09:15:00+00:00", "timeZone": "Europe/London"},
+        "recurrence": recurrence,
+    }
+    event.update(kwargs)
+    return event
+
+
+def window(start, end):
+    return LONDON.localize(start).isoformat(), LONDON.localize(end).isoformat()
+
+
+def test_daily_series_keeps_wall_clock_time_across_dst():
+    start, end = window(datetime(2024, 3, 25), datetime(2024, 4, 1))
+    events = expand_gcal_events([standup(["RRULE:FREQ=DAILY"])], "work", start, end)
+
+    assert len(events) == 7
+    # BST starts on 2024-03-31, but the standup stays at 09:00 London time
+    assert all(event.start.astimezone(LONDON).hour == 9 for event in events)
+    assert events[0].event_id == "standup_20240325T090000Z"
+    assert events[-1].event_id == "standup_20240331T080000Z"
+    assert all((event.end - event.start).seconds == 15 * 60 for event in events)
+
+
+def test_exdate_until_and_exceptions():
+    start, end = window(datetime(2024, 3, 18), datetime(2024, 3, 25))
+    items = [
+        standup([
+            "RRULE:FREQ=DAILY;UNTIL=20240322T090000Z",
+            "EXDATE;TZID=Europe/London:20240319T090000",
+        ]),
+        # the Wednesday standup was cancelled
+        {"id": "standup_20240320T090000Z", "status": "cancelled", "recurringEventId": "standup",
+         "originalStartTime": {"dateTime": "2024-03-20T09:00:00Z"}},
+        # the Thursday standup was moved to the afternoon
+        {"id": "standup_20240321T090000Z", "recurringEventId": "standup", "summary": "Late standup",
+         "originalStartTime": {"dateTime": "2024-03-21T09:00:00Z"},
+         "start": {"dateTime": "2024-03-21T15:00:00+00:00"}, "end": {"dateTime": "2024-03-21T15:15:00+00:00"}},
+        {"id": "single", "summary": "One-off",
+         "start": {"dateTime": "2024-03-19T12:00:00+00:00"}, "end": {"dateTime": "2024-03-19T13:00:00+00:00"}},
+    ]
+    events = sorted(expand_gcal_events(items, "work", start, end), key=lambda event: event.start)
+
+    assert [(event.event_id, event.summary, event.start.hour) for event in events] == [
+        ("standup_20240318T090000Z", "Standup", 9),
+        ("single", "One-off", 12),
+        ("standup_20240321T090000Z", "Late standup", 15),
+        ("standup_20240322T090000Z", "Standup", 9),
+    ]
+
+
+def test_all_day_series():
+    start, end = window(datetime(2024, 3, 18), datetime(2024, 3, 25))
+    items = [{
+        "id": "gym",
+        "summary": "Gym",
+        "start": {"date": "2024-03-01"},
+        "end": {"date": "2024-03-02"},
+        "recurrence": ["RRULE:FREQ=WEEKLY;BYDAY=MO,TH"],
+    }]
+    events = expand_gcal_events(items, "exercise", start, end)
+
+    assert [event.event_id for event in events] == ["gym_20240318", "gym_20240321"]
+    assert all(event.is_all_day for event in events)
+
+
+def test_expansion_is_memoized_per_series_and_window():
+    start, end = window(datetime(2024, 4, 1), datetime(2024, 4, 8))
+    expand_series.cache_clear()
+    expand_gcal_events([standup(["RRULE:FREQ=DAILY"])], "work", start, end)
+    expand_gcal_events([standup(["RRULE:FREQ=DAILY"])], "work", start, end)
+    assert expand_series.cache_info().hits == 1
+
+    # an update to the series is a new cache entry
+    expand_gcal_events([standup(["RRULE:FREQ=WEEKLY"], updated="2024-02-01T00:00:00Z")], "work", start, end)
+    assert expand_series.cache_info().misses == 2
+
+
+class FakeListRequest:
+    def __init__(self, items):
+        self.items = items
+
+    def execute(self):
+        return {"items": self.items}
+
+
+class FakeSeriesService:
+    """Lists the events starting in the requested window, or every event of a series when listed by iCalUID."""
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def events(self):
+        return self
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+    def list(self, calendarId, pageToken=None, iCalUID=None, timeMin=None, timeMax=None, **kwargs):
+        self.calls.append({"iCalUID": iCalUID, **kwargs})
+        if iCalUID is not None:
+            return FakeListRequest([item for item in self.items if item.get("iCalUID") == iCalUID])
+        return FakeListRequest([
+            item for item in self.items
+            if "recurrence" in item or timeMin <= item["start"]["dateTime"] < timeMax
+        ])
+
+
+def test_exception_moved_out_of_window_leaves_no_ghost(monkeypatch):
+    monkeypatch.setattr(google_calendar.settings, "get_calendar_ids", lambda: {"work": "cal_work"})
+    start, end = window(datetime(2024, 3, 18), datetime(2024, 3, 22))
+    service = FakeSeriesService([
+        standup(["RRULE:FREQ=DAILY;COUNT=5"], iCalUID="standup@google.com"),
+        # the Thursday standup was moved to the next Monday, outside the window
+        {"id": "standup_20240321T090000Z", "iCalUID": "standup@google.com", "recurringEventId": "standup",
+         "summary": "Moved standup", "originalStartTime": {"dateTime": "2024-03-21T09:00:00Z"},
+         "start": {"dateTime": "2024-03-25T09:00:00+00:00"}, "end": {"dateTime": "2024-03-25T09:15:00+00:00"}},
+    ])
+    series_cache = SeriesCache(backend=MemoryBackend())
+    events = google_calendar.get_events(service, start, end, series_cache)
+
+    assert sorted(event.event_id for event in events) == [
+        "standup_20240318T090000Z", "standup_20240319T090000Z", "standup_20240320T090000Z",
+    ]
+    assert not any("showDeleted" in call for call in service.calls)
+
+    def series_fetches():
+        return sum(call["iCalUID"] is not None for call in service.calls)
+    assert series_fetches() == 1
+    # the series is cached, so another range it is in only lists that range
+    google_calendar.get_events(service, *window(datetime(2024, 3, 19), datetime(2024, 3, 21)), series_cache)
+    assert series_fetches() == 1
+    # ... until the master is updated
+    service.items[0]["updated"] = "2024-03-19T00:00:00Z"
+    google_calendar.get_events(service, start, end, series_cache)
+    assert series_fetches() == 2
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,110 @@
+import pytest
+import time
+from datetime import datetime, timedelta
+import pytz
+from app.response_cache import ResponseCache
+
+WEEK_START = datetime(2024, 1, 1, tzinfo=pytz.utc)
+WEEK_END = WEEK_START + timedelta(days=7)
+
+
+class Counter:
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise Exception("upstream unavailable")
+        return self.data
+
+
+def test_fresh_entries_are_reused_with_stable_etag():
+    cache = ResponseCache()
+    compute = Counter([{"id": "e1"}])
+    first = cache.get(("weekly_events", "w1", "UTC"), compute, WEEK_START, WEEK_END)
+    second = cache.get(("weekly_events", "w1", "UTC"), compute, WEEK_START, WEEK_END)
+    assert compute.calls == 1
+    assert first.etag == second.etag
+    assert first.body == b'[{"id": "e1"}]'
+
+
+def test_stale_entries_are_served_while_revalidating():
+    cache = ResponseCache(fresh_for=0, stale_for=60)
+    compute = Counter([{"id": "e1"}])
+    key = ("weekly_events", "w1", "UTC")
+    cache.get(key, compute, WEEK_START, WEEK_END)
+    time.sleep(0.01)
+
+    compute.data = [{"id": "e2"}]
+    stale = cache.get(key, compute, WEEK_START, WEEK_END)
+    assert stale.body == b'[{"id": "e1"}]'
+    for _ in range(100):
+        if key not in cache.revalidating:
+            break
+        time.sleep(0.01)
+    assert cache.entries[key].body == b'[{"id": "e2"}]'
+
+
+def test_too_stale_entries_are_served_when_upstream_fails():
+    cache = ResponseCache(fresh_for=0, stale_for=0)
+    compute = Counter([{"id": "e1"}])
+    key = ("weekly_events", "w1", "UTC")
+    cache.get(key, compute, WEEK_START, WEEK_END)
+    time.sleep(0.01)
+    compute.fail = True
+    assert cache.get(key, compute, WEEK_START, WEEK_END).body == b'[{"id": "e1"}]'
+    with pytest.raises(Exception):
+        cache.get(("weekly_events", "w2", "UTC"), compute, WEEK_START, WEEK_END)
+
+
+def test_lru_eviction_by_size():
+    cache = ResponseCache(max_bytes=100)
+    for week in range(5):
+        cache.get(("weekly_events", f"w{week}", "UTC"), lambda: [{"id": "x" * 20}], WEEK_START, WEEK_END)
+        cache.get(("weekly_events", "w0", "UTC"), lambda: [], WEEK_START, WEEK_END) # keep w0 recently used
+    assert cache.size <= 100
+    assert ("weekly_events", "w0", "UTC") in cache.entries
+    assert ("weekly_events", "w1", "UTC") not in cache.entries
+
+
+def test_invalidation_is_precise():
+    cache = ResponseCache()
+    next_week_start, next_week_end = WEEK_END, WEEK_END + timedelta(days=7)
+    cache.get(("weekly_events", "w1", "UTC"), lambda: [{"id": "e1"}], WEEK_START, WEEK_END)
+    cache.get(("weekly_events", "w2", "UTC"), lambda: [{"id": "e2"}], next_week_start, next_week_end)
+    cache.get(("weekly_event_datalinks", "w1", "UTC"), lambda: {"wlog": [{"event": {"id": "e1"}}]}, WEEK_START, WEEK_END)
+
+    # e1 moved from week 1 to week 2: both weeks are invalidated, but only for events
+    moved_to = next_week_start + timedelta(days=1)
+    cache.invalidate("weekly_events", event_ids=["e1"], times=[(moved_to, moved_to + timedelta(hours=1))])
+    assert set(cache.entries) == {("weekly_event_datalinks", "w1", "UTC")}
+
+    cache.invalidate("weekly_event_datalinks", event_ids=["e1"])
+    assert cache.entries == {}
+    assert cache.size == 0
+
+
+def test_compute_overlapping_a_write_is_not_stored():
+    cache = ResponseCache()
+    key = ("weekly_events", "w1", "UTC")
+    data = {"title": "old"}
+
+    def slow_compute():
+        read = [dict(data, id="e1")]
+        # the write and its invalidation happen after the compute read its data
+        data["title"] = "new"
+        cache.invalidate("weekly_events", event_ids=["e1"])
+        return read
+
+    assert cache.get(key, slow_compute, WEEK_START, WEEK_END).body == b'[{"title": "old", "id": "e1"}]'
+    assert key not in cache.entries
+    fresh = cache.get(key, lambda: [dict(data, id="e1")], WEEK_START, WEEK_END)
+    assert fresh.body == b'[{"title": "new", "id": "e1"}]'
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,203 @@
+import pytest
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+
+from app.integrations import event_cache as event_cache_module
+from app.integrations.event_cache import EventCache
+from app.events import Event
+from app.response_cache import ResponseCache
+from app.shared_cache import InvalidationChannel, MemoryBackend, RedisBackend, SQLiteBackend
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis server (GET, SET with PX/NX, DEL, INCR) to test RedisBackend against."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), RedisStandInHandler)
+
+    def execute(self, command, *args):
+        with self.lock:
+            now = time.time()
+            self.values = {k: v for k, v in self.values.items() if v[1] is None or v[1] > now}
+            if command == b"GET":
+                value = self.values.get(args[0])
+                return None if value is None else value[0]
+            if command == b"SET":
+                options = [arg.upper() for arg in args[2:]]
+                if b"NX" in options and args[0] in self.values:
+                    return None
+                expires = None
+                if b"PX" in options:
+                    expires = now + int(args[2 + options.index(b"PX") + 1]) / 1000
+                self.values[args[0]] = (args[1], expires)
+                return "OK"
+            if command == b"DEL":
+                return int(self.values.pop(args[0], None) is not None)
+            if command == b"INCR":
+                value = int(self.values.get(args[0], (b"0", None))[0]) + 1
+                self.values[args[0]] = (str(value).encode(), None)
+                return value
+            raise ValueError(command)
+
+
+class RedisStandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            reply = self.server.execute(args[0].upper(), *args[1:])
+            if reply is None:
+                self.wfile.write(b"$-1\r\n")
+            elif isinstance(reply, int):
+                self.wfile.write(b":%d\r\n" % reply)
+            elif isinstance(reply, str):
+                self.wfile.write(b"+%s\r\n" % reply.encode())
+            else:
+                self.wfile.write(b"$%d\r\n%s\r\n" % (len(reply), reply))
+
+
+@pytest.fixture
+def redis_server():
+    server = RedisStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend_factory(request, tmp_path):
+    """Returns a function making backends that share data, as separate worker processes would."""
+    if request.param == "memory":
+        backend = MemoryBackend()
+        yield lambda: backend
+    elif request.param == "sqlite":
+        yield lambda: SQLiteBackend(str(tmp_path / "cache.db"))
+    else:
+        server = request.getfixturevalue("redis_server")
+        yield lambda: RedisBackend(*server.server_address)
+
+
+def test_backend_operations(backend_factory):
+    worker1, worker2 = backend_factory(), backend_factory()
+
+    assert worker1.get("key") is None
+    worker1.set("key", b"value")
+    assert worker2.get("key") == b"value"
+
+    worker1.set("expiring", b"value", ttl=0.05)
+    time.sleep(0.1)
+    assert worker2.get("expiring") is None
+
+    assert worker1.add("lock", b"1", ttl=10)
+    assert not worker2.add("lock", b"1", ttl=10)
+    worker1.delete("lock")
+    assert worker2.add("lock", b"1", ttl=10)
+
+    assert [worker1.incr("counter"), worker2.incr("counter"), worker1.incr("counter")] == [1, 2, 3]
+
+
+def test_invalidation_channel(backend_factory):
+    channel1 = InvalidationChannel("test", backend_factory())
+    channel2 = InvalidationChannel("test", backend_factory())
+    assert channel2.poll() == []
+
+    channel1.publish({"event_ids": ["e1"]})
+    channel2.publish({"event_ids": ["e2"]})
+    # a channel does not receive its own messages
+    assert channel2.poll() == [{"event_ids": ["e1"]}]
+    assert channel2.poll() == []
+
+
+def test_invalidation_channel_waits_for_message_being_written(backend_factory):
+    publisher = InvalidationChannel("test", backend_factory())
+    channel = InvalidationChannel("test", backend_factory(), write_timeout=0.05)
+    assert channel.poll() == []
+
+    publisher.publish({"event_ids": ["e1"]})
+    # a second publish has taken its sequence number but not written its message yet
+    seq = publisher.backend.incr("test:seq")
+    assert channel.poll() == [{"event_ids": ["e1"]}]
+    assert channel.poll() == []
+    publisher.backend.set_json(f"test:msg:{seq}", {"origin": publisher.origin, "message": {"event_ids": ["e2"]}})
+    assert channel.poll() == [{"event_ids": ["e2"]}]
+
+    # a message whose publisher never wrote it is given up on after write_timeout
+    publisher.backend.incr("test:seq")
+    assert channel.poll() == []
+    time.sleep(0.1)
+    assert channel.poll() is None
+    assert channel.poll() == []
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_bytes=25)
+    backend.set("a", b"x" * 9)
+    backend.set("b", b"x" * 9)
+    backend.get("a")
+    backend.set("c", b"x" * 9)
+    assert backend.get("b") is None
+    assert backend.get("a") is not None and backend.get("c") is not None
+    assert backend.size <= 25
+
+
+def test_sqlite_backend_sweeps_expired_rows(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.db"), sweep_every=10)
+    for i in range(9):
+        backend.set(f"expiring{i}", b"value", ttl=0.01)
+    time.sleep(0.05)
+    backend.set("kept", b"value")
+    assert backend._connection().execute("SELECT key FROM cache").fetchall() == [("kept",)]
+
+
+def test_response_cache_invalidates_across_workers(backend_factory):
+    week_start = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    week_end = week_start + timedelta(days=7)
+    worker1 = ResponseCache(channel=InvalidationChannel("responses", backend_factory()))
+    worker2 = ResponseCache(channel=InvalidationChannel("responses", backend_factory()))
+    key = ("weekly_events", week_start.isoformat(), "UTC")
+
+    worker2.get(key, lambda: [{"id": "e1"}], week_start, week_end)
+    worker1.invalidate("weekly_events", event_ids=["e1"])
+    assert worker2.get(key, lambda: [{"id": "e1", "title": "moved"}], week_start, week_end).body == b'[{"id": "e1", "title": "moved"}]'
+
+
+def test_event_cache_fetches_once_for_all_workers(backend_factory, monkeypatch):
+    fetches = []
+    event = Event("work", datetime(2024, 1, 1, 9, tzinfo=pytz.utc), datetime(2024, 1, 1, 10, tzinfo=pytz.utc), "Standup", "e1")
+    def list_calendar_items(service, start, end):
+        fetches.append((start, end))
+        return {"work": [{
+            "id": "e1", "summary": "Standup",
+            "start": {"dateTime": event.start.isoformat()}, "end": {"dateTime": event.end.isoformat()},
+        }]}
+    monkeypatch.setattr(event_cache_module, "list_calendar_items", list_calendar_items)
+
+    week = ("2024-01-01T00:00:00+00:00", "2024-01-08T00:00:00+00:00")
+    worker1, worker2 = EventCache(backend=backend_factory()), EventCache(backend=backend_factory())
+    assert [e.event_id for e in worker1.get_events(None, *week)] == ["e1"]
+    assert [e.to_json() for e in worker2.get_events(None, *week)] == [event.to_json()]
+    assert len(fetches) == 1
+
+    # a write through one worker invalidates the range for both
+    worker2.invalidate()
+    worker1.get_index(None, *week)
+    assert len(fetches) == 2
+
+
+# Run the tests
+if __name__ == "__main__":
+    pytest.main([__file__])